@@ -0,0 +1,58 @@
+"""
+Бенчмарк прогноза рейтинга (/whatif): матрица "игрок × раунд" для всего тура.
+
+Рейтинг берётся из фикстуры Snooker_world_rankings (128 игроков) и из синтетического
+рейтинга в SCALE раз больше. Печатаются минимум и медиана по повторам.
+
+    python benchmarks/bench_projection.py
+    python benchmarks/bench_projection.py --repeat 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snooker_alert_bot as bot  # noqa: E402
+
+RANKING_FIXTURE = os.path.join(ROOT, 'benchmarks', 'fixtures', 'Snooker_world_rankings.html')
+SCALE = 10
+
+
+def load_points():
+    with open(RANKING_FIXTURE, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    return [p['points_value'] for p in bot.extract_ranking_rows(bot.find_ranking_table(soup))]
+
+def bench(points, gains, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        bot.project_positions(points, gains)
+        timings.append(time.perf_counter() - t0)
+    return min(timings) * 1000, statistics.median(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='повторов на сценарий')
+    args = parser.parse_args()
+
+    points = load_points()
+    gains = [prize for _, prize in bot.PRIZE_BREAKDOWNS['world championship']]
+    cases = {
+        'fixture': points,
+        f'x{SCALE}': [p - i for i in range(SCALE) for p in points],
+    }
+    for name, case_points in cases.items():
+        best, median = bench(case_points, gains, args.repeat)
+        print(f"{name:<8} {len(case_points):>5} игроков × {len(gains)} раундов   "
+              f"median {median:>7.3f} ms   min {best:>7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Офлайн-бенчмарк парсеров бота на сохранённых страницах Википедии.
+
+Фикстуры в benchmarks/fixtures повторяют разметку статей
+`2025–26_snooker_season` и `Snooker_world_rankings`. Кроме них гоняем
+синтетические страницы, где строк в целевой таблице в SCALE раз больше.
+Страницы отдаются через HTTP-транспорт бота в режиме replay: фикстуры
+записываются во временную кассету, так что этап fetch проходит тот же путь,
+что и в боте, а задержку и долю ошибок можно задать флагами.
+
+Для каждого этапа (fetch, parse, table discovery, row extraction, render, chunk)
+пишется минимум и медиана по повторам, плюс пиковая память одного полного прогона
+(tracemalloc). Кэши строк и отрендеренного текста бота перед каждым прогоном очищаются,
+так что этапы меряются «холодными» и сравнимы с ранними отчётами; повторный разбор
+той же страницы из кэша — отдельно, как row_extraction_warm и render_warm.
+Результат сохраняется в JSON, два JSON можно сравнить через --compare.
+
+    python benchmarks/bench_scrapers.py
+    python benchmarks/bench_scrapers.py --repeat 20 --output base.json
+    python benchmarks/bench_scrapers.py --latency 0.05 --error-rate 0.1
+    python benchmarks/bench_scrapers.py --compare base.json new.json
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import requests
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snooker_alert_bot as bot  # noqa: E402
+
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+SEASON_FIXTURE = '2025-26_snooker_season.html'
+RANKING_FIXTURE = 'Snooker_world_rankings.html'
+SEASON_START = 2025  # сезон фикстуры
+SCALE = 10
+WARM_STAGES = ('row_extraction', 'render')  # этапы, которые бот кэширует между обновлениями
+
+# Сценарий: файл фикстуры, URL страницы, разбор страницы, поиск таблицы, разбор строк, рендер.
+# Календарь бот режет по тегам в сырой разметке, дерево всей статьи не строит, поэтому его
+# этап parse — пустой, а table discovery получает HTML как есть.
+SCENARIOS = {
+    'schedule': (SEASON_FIXTURE, bot.season_url(SEASON_START), str, bot.schedule_row_markup,
+                 functools.partial(bot.extract_schedule_rows, season_start=SEASON_START), bot.render_schedule),
+    'ranking': (RANKING_FIXTURE, bot.RANKING_URL, functools.partial(BeautifulSoup, features='html.parser'),
+                bot.find_ranking_table, bot.extract_ranking_rows, bot.render_ranking),
+}
+
+
+# === Подготовка страниц ===
+def read_page(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def scale_page(html, parse, find_table, factor):
+    """Размножает строки целевой таблицы в factor раз, остальная страница не меняется."""
+    if parse is str:  # таблица найдена в сырой разметке: строки вставляются после последней
+        rows = find_table(html)
+        end = html.index(rows[-1]) + len(rows[-1])
+        return html[:end] + "".join(rows) * (factor - 1) + html[end:]
+    soup = parse(html)
+    table = find_table(soup)
+    rows = table.find_all('tr')[1:]
+    parent = rows[-1].parent
+    for _ in range(factor - 1):
+        for row in rows:
+            parent.append(BeautifulSoup(str(row), 'html.parser'))
+    return str(soup)
+
+
+# === Прогон ===
+def reset_caches():
+    """Кэши строк календаря и их текста, которые живут между обновлениями в боте."""
+    bot._schedule_rows.clear()
+    bot._rendered_rows.clear()
+
+def run_pipeline(url, parse, find_table, extract_rows, render, timings=None, cold=True):
+    """Один проход всех этапов; если передан timings, дописывает туда длительности."""
+    if cold:
+        reset_caches()
+
+    def stage(name, func, *args):
+        t0 = time.perf_counter()
+        result = func(*args)
+        if timings is not None:
+            timings.setdefault(name, []).append(time.perf_counter() - t0)
+        return result
+
+    page = stage('fetch', bot.fetch_html, url)
+    document = stage('parse', parse, page)
+    table = stage('table_discovery', find_table, document)
+    rows = stage('row_extraction', extract_rows, table)
+    text = stage('render', render, rows)
+    parts = stage('chunk', bot.split_message, text)
+    return rows, parts
+
+def run_until_ok(url, parse, find_table, extract_rows, render, timings=None, cold=True):
+    """Повторяет прогон, пока транспорт не ответит без ошибки; возвращает результат и число ошибок."""
+    errors = 0
+    while True:
+        try:
+            return run_pipeline(url, parse, find_table, extract_rows, render, timings, cold), errors
+        except requests.RequestException:
+            errors += 1
+
+def bench_case(url, body, parse, find_table, extract_rows, render, repeat):
+    bot.save_cassette(url, 200, {'Content-Type': 'text/html; charset=UTF-8'}, body)
+    timings = {}
+    (rows, parts), errors = run_until_ok(url, parse, find_table, extract_rows, render)  # прогрев
+    for _ in range(repeat):
+        errors += run_until_ok(url, parse, find_table, extract_rows, render, timings)[1]
+
+    warm = {}
+    run_until_ok(url, parse, find_table, extract_rows, render)  # наполняем кэши
+    for _ in range(repeat):
+        errors += run_until_ok(url, parse, find_table, extract_rows, render, warm, cold=False)[1]
+
+    tracemalloc.start()
+    run_until_ok(url, parse, find_table, extract_rows, render)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = {
+        name: {
+            'min_ms': round(min(values) * 1000, 3),
+            'median_ms': round(statistics.median(values) * 1000, 3),
+        }
+        for name, values in timings.items()
+    }
+    total = sum(s['median_ms'] for s in stages.values())
+    for name in WARM_STAGES:
+        stages[f'{name}_warm'] = {
+            'min_ms': round(min(warm[name]) * 1000, 3),
+            'median_ms': round(statistics.median(warm[name]) * 1000, 3),
+        }
+    return {
+        'page_bytes': len(body.encode('utf-8')),
+        'fetch_errors': errors,
+        'rows': len(rows),
+        'messages': len(parts),
+        'stages': stages,
+        'total_median_ms': round(total, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+def run_benchmarks(repeat, latency=0.0, error_rate=0.0):
+    results = {}
+    with tempfile.TemporaryDirectory() as cassettes:
+        bot.set_http_mode('replay', cassette_dir=cassettes, latency=latency, error_rate=error_rate)
+        bot.PAGE_CACHE_TTL = 0  # меряем сам транспорт, а не кэш страниц
+        for name, (fixture, url, parse, find_table, extract_rows, render) in SCENARIOS.items():
+            body = read_page(os.path.join(FIXTURES_DIR, fixture))
+            results[f'{name}_fixture'] = bench_case(url, body, parse, find_table, extract_rows, render, repeat)
+
+            scaled = scale_page(body, parse, find_table, SCALE)
+            scaled_url = f"{url}?scale={SCALE}"
+            results[f'{name}_x{SCALE}'] = bench_case(scaled_url, scaled, parse, find_table, extract_rows, render, repeat)
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'replay_latency': latency,
+        'replay_error_rate': error_rate,
+        'cases': results,
+    }
+
+
+# === Вывод и сравнение ===
+def print_report(report):
+    for case, data in report['cases'].items():
+        print(f"\n{case}: {data['rows']} строк, {data['page_bytes'] // 1024} КБ, "
+              f"{data['messages']} сообщ., пик памяти {data['peak_memory_kb']} КБ, "
+              f"ошибок загрузки {data['fetch_errors']}")
+        for stage, t in data['stages'].items():
+            print(f"  {stage:<19} median {t['median_ms']:>9.3f} ms   min {t['min_ms']:>9.3f} ms")
+        print(f"  {'total':<19} median {data['total_median_ms']:>9.3f} ms")
+
+def compare_reports(old_path, new_path):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    for case, data in new['cases'].items():
+        base = old['cases'].get(case)
+        if not base:
+            continue
+        print(f"\n{case}:")
+        for stage, t in data['stages'].items():
+            before = base['stages'].get(stage, {}).get('median_ms')
+            if not before:
+                continue
+            delta = (t['median_ms'] - before) / before * 100
+            print(f"  {stage:<19} {before:>9.3f} -> {t['median_ms']:>9.3f} ms  ({delta:+.1f}%)")
+        mem_before = base['peak_memory_kb']
+        print(f"  {'peak memory':<19} {mem_before:>9.1f} -> {data['peak_memory_kb']:>9.1f} КБ")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='повторов на сценарий')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию benchmarks/results/<время>.json)')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка replay-ответа, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля replay-ответов с ошибкой, 0..1')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='сравнить два JSON-отчёта')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    report = run_benchmarks(args.repeat, args.latency, args.error_rate)
+    print_report(report)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Сравнение доставки апдейтов: run_polling против webhook-режима бота.
+
+Вместо Telegram — локальная подделка:
+  * polling: FakeTelegramRequest подменяет HTTP-слой python-telegram-bot и отвечает
+    на getUpdates из очереди апдейтов с задержкой RTT (как настоящий long-poll);
+  * webhook: фейковый клиент шлёт POST на HTTP-сервер бота с секретным заголовком
+    по --connections постоянным (keep-alive) соединениям, как делает Telegram
+    с max_connections; каждый запрос идёт с задержкой RTT/2 в одну сторону.
+
+В обоих режимах апдейты появляются с постоянной частотой --rate в секунду,
+обработчик лишь отмечает время получения. Печатаются пропускная способность
+(апдейтов в секунду от первого появления до последней обработки) и задержка p50/p95.
+
+    python benchmarks/bench_webhook.py
+    python benchmarks/bench_webhook.py --updates 5000 --rate 2000 --rtt 0.08
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+from telegram.request import BaseRequest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snooker_alert_bot as bot  # noqa: E402
+
+FAKE_TOKEN = '123456:TEST-TOKEN'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'snooker_alert_bot', 'username': 'snooker_alert_bot'}
+
+
+def make_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 1000 + update_id % 50, 'type': 'private'},
+            'from': {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'User'},
+            'text': f'hello {update_id}',
+        },
+    }
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Отвечает на вызовы Bot API без сети; getUpdates отдаёт накопившиеся апдейты."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.pending = []
+        self.arrived = asyncio.Event()
+
+    def push(self, update):
+        self.pending.append(update)
+        self.arrived.set()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        await asyncio.sleep(self.rtt / 2)
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'getUpdates':
+            params = request_data.parameters if request_data else {}
+            offset = params.get('offset') or 0
+            self.pending = [u for u in self.pending if u['update_id'] >= offset]
+            if not self.pending:
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), params.get('timeout') or 10)
+                except asyncio.TimeoutError:
+                    pass
+            result = self.pending[:params.get('limit') or 100]
+        else:
+            result = True
+        await asyncio.sleep(self.rtt / 2)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def build_app(fake, received):
+    app = ApplicationBuilder().token(FAKE_TOKEN).request(fake).get_updates_request(fake).build()
+
+    async def on_message(update, context):
+        received[update.update_id] = time.perf_counter()
+
+    app.add_handler(MessageHandler(filters.TEXT, on_message))
+    return app
+
+
+async def wait_received(received, total):
+    while len(received) < total:
+        await asyncio.sleep(0.001)
+
+
+async def produce(total, rate, deliver):
+    """Выпускает апдейты с частотой rate и передаёт их в deliver; возвращает времена появления."""
+    created = {}
+    start = time.perf_counter()
+    tasks = []
+    for i in range(1, total + 1):
+        delay = start + (i - 1) / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        created[i] = time.perf_counter()
+        tasks.append(asyncio.ensure_future(deliver(make_update(i))))
+    await asyncio.gather(*tasks)
+    return created
+
+
+async def bench_polling(total, rate, rtt):
+    fake = FakeTelegramRequest(rtt)
+    received = {}
+    app = build_app(fake, received)
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+
+        async def deliver(update):
+            fake.push(update)
+
+        created = await produce(total, rate, deliver)
+        await wait_received(received, total)
+        await app.updater.stop()
+        await app.stop()
+    return created, received
+
+
+async def webhook_client(queue, rtt, secret):
+    """Одно постоянное соединение фейкового Telegram: шлёт апдейты из очереди по одному."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', bot.HTTP_PORT)
+    try:
+        while True:
+            update = await queue.get()
+            if update is None:
+                return
+            body = json.dumps(update).encode('utf-8')
+            await asyncio.sleep(rtt / 2)
+            writer.write(
+                b'POST ' + bot.WEBHOOK_PATH.encode() + b' HTTP/1.1\r\nHost: localhost\r\n'
+                b'Content-Type: application/json\r\n'
+                b'X-Telegram-Bot-Api-Secret-Token: ' + secret + b'\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+            )
+            await writer.drain()
+            status = (await reader.readline()).split()[1]
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            await reader.readline()  # тело ответа: "ok\n"
+            if status != b'200':
+                raise RuntimeError(f'webhook ответил {status.decode()}')
+    finally:
+        writer.close()
+
+
+async def bench_webhook(total, rate, rtt, connections):
+    fake = FakeTelegramRequest(rtt)
+    received = {}
+    app = build_app(fake, received)
+    app.post_init = bot.start_http_server
+    app.post_shutdown = bot.stop_http_server
+    bot.WEBHOOK_URL = None
+    bot.HTTP_HOST = '127.0.0.1'
+
+    stop = asyncio.Event()
+    server = asyncio.ensure_future(bot.run_webhook(app, stop))
+    while 'http_server' not in app.bot_data:
+        await asyncio.sleep(0.01)
+
+    queue = asyncio.Queue()
+    secret = bot.webhook_secret().encode('utf-8')
+    clients = [asyncio.ensure_future(webhook_client(queue, rtt, secret)) for _ in range(connections)]
+
+    async def deliver(update):
+        queue.put_nowait(update)
+
+    created = await produce(total, rate, deliver)
+    await wait_received(received, total)
+    for _ in clients:
+        queue.put_nowait(None)
+    await asyncio.gather(*clients)
+    stop.set()
+    await server
+    return created, received
+
+
+def summarize(name, created, received):
+    latencies = sorted((received[i] - created[i]) * 1000 for i in created)
+    duration = max(received.values()) - min(created.values())
+    result = {
+        'updates': len(created),
+        'throughput_per_s': round(len(created) / duration, 1),
+        'latency_p50_ms': round(statistics.median(latencies), 2),
+        'latency_p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+    print(f"{name:<8} {result['throughput_per_s']:>9.1f} апд/с   "
+          f"p50 {result['latency_p50_ms']:>8.2f} ms   p95 {result['latency_p95_ms']:>8.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=1000, help='апдейтов в секунду')
+    parser.add_argument('--rtt', type=float, default=0.05, help='круговая задержка до Telegram, с')
+    parser.add_argument('--connections', type=int, default=bot.WEBHOOK_MAX_CONNECTIONS,
+                        help='параллельных webhook-соединений (max_connections)')
+    parser.add_argument('--port', type=int, default=18443)
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    args = parser.parse_args()
+
+    bot.HTTP_PORT = args.port
+    print(f"{args.updates} апдейтов, {args.rate:g}/с, RTT {args.rtt * 1000:g} ms")
+    report = {
+        'polling': summarize('polling', *asyncio.run(bench_polling(args.updates, args.rate, args.rtt))),
+        'webhook': summarize('webhook', *asyncio.run(
+            bench_webhook(args.updates, args.rate, args.rtt, args.connections))),
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'params': vars(args), **report}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
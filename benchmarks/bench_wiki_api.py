@@ -0,0 +1,176 @@
+"""
+Сколько байт уходит на одно обновление: вся статья против раздела через MediaWiki API.
+
+Локальный сервер-заглушка отдаёт фикстуры из benchmarks/fixtures двумя способами:
+  * /wiki/<статья> — страница целиком, как сейчас качает fetch_html;
+  * /w/api.php?action=parse — prop=revid, prop=sections и prop=text&section=N,
+    разделы режутся по заголовкам mw-heading так же, как их нумерует MediaWiki.
+Статья "правится" каждые --edit-every обновлений (revid растёт), остальное время
+бот должен обходиться одним запросом revid. Печатаются байты и запросы на обновление
+для одного wikipedia_html, одного mediawiki_api и набора провайдеров по умолчанию
+(DATA_PROVIDERS и PROVIDER_FANOUT как в боте).
+
+    python benchmarks/bench_wiki_api.py
+    python benchmarks/bench_wiki_api.py --refreshes 50 --edit-every 5
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snooker_alert_bot as bot  # noqa: E402
+
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+PAGES = {
+    '2025–26_snooker_season': '2025-26_snooker_season.html',
+    'Snooker_world_rankings': 'Snooker_world_rankings.html',
+}
+SEASON_START = 2025  # сезон фикстуры
+DEFAULT_PROVIDERS = list(bot.DATA_PROVIDERS)  # до того, как run() начнёт их подменять
+MODES = {
+    'full page': ['wikipedia_html'],
+    'wiki api': ['mediawiki_api'],
+    'default': DEFAULT_PROVIDERS,
+}
+HEADING_RE = re.compile(r'<div class="mw-heading mw-heading(\d)"><h\d id="[^"]*">([^<]*)</h\d>')
+
+
+def split_sections(html):
+    """[(уровень, заголовок, html)] — раздел 0 до первого заголовка, как в MediaWiki."""
+    body = html[html.index('<body'):html.rindex('</body>')]
+    headings = list(HEADING_RE.finditer(body))
+    sections = [(1, '', body[:headings[0].start()] if headings else body)]
+    for i, m in enumerate(headings):
+        level = int(m.group(1))
+        end = next((h.start() for h in headings[i + 1:] if int(h.group(1)) <= level), len(body))
+        sections.append((level, m.group(2), body[m.start():end]))
+    return sections
+
+
+class StandInWiki:
+    """Состояние заглушки: страницы, номер ревизии и счётчики трафика."""
+
+    def __init__(self):
+        self.pages = {}
+        for title, fixture in PAGES.items():
+            with open(os.path.join(FIXTURES_DIR, fixture), 'r', encoding='utf-8') as f:
+                self.pages[title] = f.read()
+        self.revid = 1000
+        self.bytes = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def edit(self):
+        self.revid += 1
+
+    def count(self, body):
+        with self.lock:
+            self.bytes += len(body)
+            self.requests += 1
+
+    def api(self, params):
+        title = params['page'][0]
+        html = self.pages.get(title)
+        if html is None:
+            return {'error': {'code': 'missingtitle', 'info': f"The page you specified doesn't exist: {title}"}}
+        prop = params.get('prop', ['text'])[0]
+        if prop == 'revid':
+            return {'parse': {'title': title, 'pageid': 1, 'revid': self.revid}}
+        sections = split_sections(html)
+        if prop == 'sections':
+            return {'parse': {'title': title, 'sections': [
+                {'toclevel': level - 1, 'level': str(level), 'line': line, 'index': str(i)}
+                for i, (level, line, _) in enumerate(sections) if i
+            ]}}
+        index = int(params.get('section', ['0'])[0])
+        return {'parse': {'title': title, 'revid': self.revid, 'text': sections[index][2]}}
+
+
+def make_handler(wiki):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/w/api.php':
+                body = json.dumps(wiki.api(parse_qs(url.query)), ensure_ascii=False).encode('utf-8')
+                ctype = 'application/json; charset=utf-8'
+            elif url.path.startswith('/wiki/') and unquote(url.path[6:]) in wiki.pages:
+                body = wiki.pages[unquote(url.path[6:])].encode('utf-8')
+                ctype = 'text/html; charset=UTF-8'
+            else:
+                self.send_error(404)
+                return
+            wiki.count(body)
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def refresh_all():
+    tournaments = bot.scrape_season(SEASON_START)
+    players = bot.get_ranking_players()
+    if not tournaments or not players:
+        raise RuntimeError('таблица не найдена')
+
+
+def run(wiki, providers, refreshes, edit_every):
+    bot.DATA_PROVIDERS = providers
+    bot._provider_stats.clear()
+    bot._page_cache.clear()
+    bot._parsed_pages.clear()
+    bot._api_sections.clear()
+    bot._api_revisions.clear()
+    wiki.bytes = wiki.requests = 0
+    for i in range(refreshes):
+        if i and i % edit_every == 0:
+            wiki.edit()
+        refresh_all()
+    return wiki.bytes / refreshes, wiki.requests / refreshes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--refreshes', type=int, default=20, help='обновлений календаря и рейтинга')
+    parser.add_argument('--edit-every', type=int, default=10, help='статья меняется раз в столько обновлений')
+    args = parser.parse_args()
+
+    wiki = StandInWiki()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(wiki))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    bot.set_http_mode('live')
+    bot.PAGE_CACHE_TTL = 0
+    bot.WIKI_BASE_URL = base
+    bot.WIKI_API_URL = f"{base}/w/api.php"
+    bot.RANKING_URL = f"{base}/wiki/Snooker_world_rankings"
+    with tempfile.TemporaryDirectory() as history:
+        bot.RANKING_HISTORY_DIR = history
+        results = {name: run(wiki, providers, args.refreshes, args.edit_every) for name, providers in MODES.items()}
+    server.shutdown()
+
+    print(f"{args.refreshes} обновлений, правка статьи раз в {args.edit_every}, "
+          f"по умолчанию {','.join(DEFAULT_PROVIDERS)} по {bot.PROVIDER_FANOUT}")
+    for name, (size, count) in results.items():
+        print(f"  {name:<10} {size / 1024:>9.1f} КБ/обновление   {count:>5.2f} запросов/обновление")
+    full = results['full page'][0]
+    for name in ('wiki api', 'default'):
+        print(f"  {name}: трафик меньше в {full / results[name][0]:.1f} раза")
+
+
+if __name__ == '__main__':
+    main()
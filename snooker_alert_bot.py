@@ -1,13 +1,38 @@
 import logging
 import asyncio
 import requests
-from bs4 import BeautifulSoup
+import urllib3
+import numpy as np
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import datetime, timedelta, time as dt_time
 import pytz
 import json
 import os
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-from telegram import Update, ReplyKeyboardMarkup
+import time
+import random
+import hashlib
+import re
+import html as html_lib
+import unicodedata
+import functools
+import concurrent.futures
+import bisect
+import heapq
+import itertools
+import hmac
+import signal
+import threading
+import socket
+import sqlite3
+import fcntl
+import contextlib
+from collections import deque
+from urllib.parse import urlparse, quote, unquote, urlencode
+from telegram.ext import (ApplicationBuilder, CallbackContext, CommandHandler, CallbackQueryHandler, InlineQueryHandler,
+                          MessageHandler, ContextTypes, filters)
+from telegram import (Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup,
+                      InlineQueryResultArticle, InputTextMessageContent)
+from telegram.request import HTTPXRequest
 import sys
 
 print("Python version:", sys.version)
@@ -16,14 +41,274 @@ print("Python version:", sys.version)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OWNER_CHAT_ID = 734782204
 SUBSCRIBERS_FILE = 'subscribers.json'
+FOLLOWS_FILE = 'follows.json'
+TOURNAMENT_SUBS_FILE = 'tournament_subscriptions.json'
+USER_PREFS_FILE = 'user_prefs.json'
+RANKING_HISTORY_DIR = 'ranking_history'
 LOCAL_TZ = pytz.timezone("Europe/Moscow")  # часовой пояс
-CURRENT_YEAR = 2025  # Год для парсинга дат из расписания (можно менять)
+SEASON_START_MONTH = 6  # сезон 2025–26 — это июнь 2025 … май 2026
+SEASON_PREFETCH_DAYS = 30  # за сколько дней до смены сезона начинать подгружать следующий
+SEASONS_DIR = 'seasons'  # постоянный кэш завершённых сезонов
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
+# === Метрики (текстовый формат Prometheus) ===
+# Обработчики только дописывают событие в deque (append атомарен, блокировок нет),
+# агрегация в счётчики и гистограммы делается пачкой — при запросе /metrics
+# или когда очередь разрослась.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_MAX_PENDING = 10000
+
+METRIC_HELP = {
+    'snooker_command_duration_seconds': ('histogram', 'Время обработки команды бота'),
+    'snooker_command_errors_total': ('counter', 'Команды, завершившиеся исключением'),
+    'snooker_fetch_duration_seconds': ('histogram', 'Время загрузки страницы'),
+    'snooker_fetch_errors_total': ('counter', 'Ошибки загрузки страницы'),
+    'snooker_parse_duration_seconds': ('histogram', 'Время разбора страницы'),
+    'snooker_cache_requests_total': ('counter', 'Обращения к кэшу (result=hit|miss)'),
+    'snooker_broadcast_messages_total': ('counter', 'Сообщения рассылки (result=ok|error)'),
+    'snooker_broadcast_duration_seconds': ('histogram', 'Длительность одной рассылки'),
+    'snooker_bot_api_calls_total': ('counter', 'Вызовы Telegram Bot API'),
+    'snooker_bot_api_errors_total': ('counter', 'Ошибки вызовов Telegram Bot API'),
+    'snooker_bot_api_duration_seconds': ('histogram', 'Время вызова Telegram Bot API'),
+    'snooker_throttled_total': ('counter', 'Команды, отклонённые лимитером (scope=chat|global)'),
+    'snooker_webhook_updates_total': ('counter', 'Апдейты, пришедшие через webhook (result=ok|forbidden|bad_request)'),
+    'snooker_inline_duration_seconds': ('histogram', 'Время ответа на inline-запрос'),
+    'snooker_circuit_open_total': ('counter', 'Размыкания предохранителя по хосту'),
+    'snooker_fetch_hedged_total': ('counter', 'Загрузки, для которых ушёл второй (хеджирующий) запрос'),
+    'snooker_provider_duration_seconds': ('histogram', 'Время ответа провайдера данных'),
+    'snooker_provider_errors_total': ('counter', 'Ошибки провайдеров данных'),
+    'snooker_job_duration_seconds': ('histogram', 'Время выполнения задачи планировщика'),
+}
+
+_metric_events = deque()
+_metrics_lock = threading.Lock()  # берётся только при агрегации, не в горячем пути
+_counters = {}
+_histograms = {}
+
+def inc_counter(name, value=1, **labels):
+    _metric_events.append(('c', name, tuple(sorted(labels.items())), value))
+    if len(_metric_events) > METRICS_MAX_PENDING:
+        drain_metrics()
+
+def observe(name, value, **labels):
+    _metric_events.append(('h', name, tuple(sorted(labels.items())), value))
+    if len(_metric_events) > METRICS_MAX_PENDING:
+        drain_metrics()
+
+def record_cache(cache, hit):
+    inc_counter('snooker_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def drain_metrics():
+    with _metrics_lock:
+        while True:
+            try:
+                kind, name, labels, value = _metric_events.popleft()
+            except IndexError:
+                break
+            key = (name, labels)
+            if kind == 'c':
+                _counters[key] = _counters.get(key, 0) + value
+                continue
+            hist = _histograms.get(key)
+            if hist is None:
+                # счётчики по корзинам + сумма + общее количество
+                hist = _histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += value
+            hist[-1] += 1
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def render_metrics():
+    drain_metrics()
+    lines = []
+    with _metrics_lock:
+        for name, (kind, help_text) in METRIC_HELP.items():
+            series = _counters if kind == 'counter' else _histograms
+            keys = sorted(k for k in series if k[0] == name)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {series[key]}")
+                    continue
+                hist = series[key]
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, hist):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {hist[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {hist[-2]:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
+
+def track_command(command):
+    """Декоратор для обработчиков: время выполнения и ошибки по имени команды."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                inc_counter('snooker_command_errors_total', command=command)
+                raise
+            finally:
+                observe('snooker_command_duration_seconds', time.perf_counter() - t0, command=command)
+        return wrapper
+    return decorator
+
+class MetricsRequest(HTTPXRequest):
+    """HTTPXRequest, который считает вызовы Bot API по методам."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            result = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            inc_counter('snooker_bot_api_errors_total', endpoint=endpoint)
+            raise
+        finally:
+            observe('snooker_bot_api_duration_seconds', time.perf_counter() - t0, endpoint=endpoint)
+        inc_counter('snooker_bot_api_calls_total', endpoint=endpoint)
+        return result
+
+# === Ограничение частоты тяжёлых команд (token bucket) ===
+# У каждого чата своё ведро, плюс одно общее на весь бот, чтобы один спамер
+# не съел лимит Bot API, нужный рассылке. Команда списывает COMMAND_COSTS[команда]
+# токенов из обоих вёдер; если не хватает — отвечаем последним закэшированным результатом.
+COMMAND_COSTS = {
+    'players_ranking': 3,          # скрейп + до дюжины сообщений
+    'current_season_schedule': 2,
+    'upcoming_tournament': 1,
+    'season': 2,                   # прошлые сезоны дёшевы, но первый запрос — скрейп
+    'tournament': 3,               # целая статья турнира: загрузка и разбор
+    'whatif': 2,
+    'movers': 1,
+    'follow': 1,
+}
+CHAT_BUCKET_CAPACITY = 6
+CHAT_BUCKET_RATE = 0.1      # токенов в секунду (6 в минуту)
+GLOBAL_BUCKET_CAPACITY = 60
+GLOBAL_BUCKET_RATE = 1.0
+BUCKET_EVICT_INTERVAL = 600  # секунд между чистками вёдер
+
+# chat_id -> (токены, время обновления); полные вёдра удаляются при чистке,
+# так что в памяти только чаты, которые недавно что-то тратили
+_chat_buckets = {}
+_global_bucket = [GLOBAL_BUCKET_CAPACITY, time.monotonic()]
+_reply_cache = {}  # (команда, ключ аргументов) -> последний полный ответ
+
+def refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + (now - updated) * rate)
+
+def take_tokens(chat_id, cost):
+    """Списывает cost из ведра чата и глобального; возвращает None или имя исчерпанного ведра."""
+    now = time.monotonic()
+    tokens, updated = _chat_buckets.get(chat_id, (CHAT_BUCKET_CAPACITY, now))
+    chat_tokens = refill(tokens, updated, CHAT_BUCKET_CAPACITY, CHAT_BUCKET_RATE, now)
+    global_tokens = refill(*_global_bucket, GLOBAL_BUCKET_CAPACITY, GLOBAL_BUCKET_RATE, now)
+    if chat_tokens < cost:
+        _chat_buckets[chat_id] = (chat_tokens, now)
+        return 'chat'
+    if global_tokens < cost:
+        _chat_buckets[chat_id] = (chat_tokens, now)
+        return 'global'
+    _chat_buckets[chat_id] = (chat_tokens - cost, now)
+    _global_bucket[:] = [global_tokens - cost, now]
+    return None
+
+async def evict_buckets(context: ContextTypes.DEFAULT_TYPE):
+    now = time.monotonic()
+    full = [
+        chat_id for chat_id, (tokens, updated) in _chat_buckets.items()
+        if refill(tokens, updated, CHAT_BUCKET_CAPACITY, CHAT_BUCKET_RATE, now) >= CHAT_BUCKET_CAPACITY
+    ]
+    for chat_id in full:
+        del _chat_buckets[chat_id]
+
+def remember_reply(command, text, key=None):
+    _reply_cache[(command, key)] = text
+
+def short_reply(text, max_lines=12):
+    lines = text.split("\n")
+    if len(lines) <= max_lines:
+        return text
+    return "\n".join(lines[:max_lines]) + "\n..."
+
+def throttled(command, key=None):
+    """Декоратор для тяжёлых команд: при исчерпанном лимите — короткий ответ из кэша без скрейпа.
+
+    key(context) выделяет из аргументов то, от чего зависит ответ (например, сезон у /season),
+    чтобы из кэша не ушёл ответ на чужой запрос; None — подходящего ответа в кэше нет.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            exhausted = take_tokens(update.effective_chat.id, COMMAND_COSTS.get(command, 1))
+            if exhausted is None:
+                return await handler(update, context)
+            inc_counter('snooker_throttled_total', command=command, scope=exhausted)
+            cached = _reply_cache.get((command, key(context) if key else None))
+            if cached:
+                await update.message.reply_text("🐢 Слишком часто. Последние данные:\n\n" + short_reply(cached))
+            else:
+                await update.message.reply_text("🐢 Слишком много запросов, попробуй через минуту.")
+        return wrapper
+    return decorator
+
+# === Общие файлы ===
+# JSON-файлы подписок и настроек могут писать несколько реплик бота сразу (см. «Реплики и лидер»).
+# Чтение-изменение-запись делается под shared_file_lock, запись атомарна (временный файл + os.replace),
+# а закэшированные копии перечитываются, если файл с тех пор поменяла другая реплика.
+_shared_versions = {}  # путь -> версия файла, которую эта реплика последней читала или писала
+
+def file_version(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        return None
+
+def shared_file_changed(path):
+    return _shared_versions.get(path) != file_version(path)
+
+def remember_version(path):
+    _shared_versions[path] = file_version(path)
+
+@contextlib.contextmanager
+def shared_file_lock(path):
+    """Межпроцессная блокировка path на время чтения-изменения-записи (через файл path.lock)."""
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def write_json_atomic(path, data, **kwargs):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp, path)
+    remember_version(path)
+
 # === Подписчики ===
 def load_subscribers():
     if os.path.exists(SUBSCRIBERS_FILE):
@@ -32,8 +317,27 @@ def load_subscribers():
     return set()
 
 def save_subscribers(subscribers):
-    with open(SUBSCRIBERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(list(subscribers), f)
+    write_json_atomic(SUBSCRIBERS_FILE, list(subscribers))
+
+def add_subscriber(chat_id):
+    """-> True, если chat_id ещё не был подписан."""
+    with shared_file_lock(SUBSCRIBERS_FILE):
+        subscribers = load_subscribers()
+        if chat_id in subscribers:
+            return False
+        subscribers.add(chat_id)
+        save_subscribers(subscribers)
+        return True
+
+def remove_subscriber(chat_id):
+    """-> True, если chat_id был подписан."""
+    with shared_file_lock(SUBSCRIBERS_FILE):
+        subscribers = load_subscribers()
+        if chat_id not in subscribers:
+            return False
+        subscribers.remove(chat_id)
+        save_subscribers(subscribers)
+        return True
 
 # === Парсинг дат ===
 def parse_date(date_str):
@@ -48,16 +352,43 @@ def parse_date(date_str):
         except Exception:
             return None
 
-def parse_start_finish_date(date_str):
+def parse_start_finish_date(date_str, season_start):
     """
-    Парсит дату формата '30 Mar' или '5 Apr' в объект date с годом CURRENT_YEAR.
+    Парсит дату формата '30 Mar' или '5 Apr' в объект date.
+    Июнь–декабрь относятся к году season_start, январь–май — к следующему.
     """
     try:
-        dt = datetime.strptime(f"{date_str} {CURRENT_YEAR}", "%d %b %Y")
-        return dt.date()
+        dt = datetime.strptime(f"{date_str} 2000", "%d %b %Y")  # 2000 — високосный, 29 Feb тоже парсится
+        year = season_start if dt.month >= SEASON_START_MONTH else season_start + 1
+        return dt.replace(year=year).date()
     except Exception:
         return None
 
+# === Сезоны ===
+def current_season(today=None):
+    """Год начала текущего сезона: 2025 для сезона 2025–26."""
+    today = today or datetime.now(LOCAL_TZ).date()
+    return today.year if today.month >= SEASON_START_MONTH else today.year - 1
+
+def season_label(season_start):
+    return f"{season_start}–{(season_start + 1) % 100:02d}"
+
+def parse_season_label(text):
+    """'2023-24', '2023–24', '2023/2024' или просто '2023' -> 2023; None, если не разобрать."""
+    match = re.fullmatch(r'\s*(\d{4})(?:\s*[-–—/]\s*(\d{2}|\d{4}))?\s*', text or '')
+    if not match:
+        return None
+    start = int(match.group(1))
+    end = match.group(2)
+    if end and int(end) % 100 != (start + 1) % 100:
+        return None
+    return start
+
+WIKI_BASE_URL = "https://en.wikipedia.org"
+
+def season_url(season_start):
+    return f"{WIKI_BASE_URL}/wiki/" + quote(f"{season_label(season_start)}_snooker_season")
+
 # === Функции для флагов ===
 def alpha2_to_emoji(alpha2):
     if len(alpha2) != 2:
@@ -65,144 +396,1197 @@ def alpha2_to_emoji(alpha2):
     OFFSET = 127397
     return chr(ord(alpha2[0].upper()) + OFFSET) + chr(ord(alpha2[1].upper()) + OFFSET)
 
-# Пример словаря для конвертации ISO Alpha-3 в Alpha-2 коды (можно дополнить при необходимости)
-alpha3_to_alpha2 = {
-    'ENG': 'GB',
-    'SCO': 'GB',
-    'WAL': 'GB',
-    'WLS': 'GB',
-    'NIR': 'GB',
-    'CHN': 'CN',
-    'IRL': 'IE',
-    'USA': 'US',
-    'AUS': 'AU',
-    'NZL': 'NZ',
-    'FRA': 'FR',
-    'GER': 'DE',
-    'ESP': 'ES',
-    'RUS': 'RU',
-    # Добавляйте по необходимости
+def subdivision_emoji(code):
+    """'gbeng' -> флаг-последовательность из тегов Unicode (Англия, Шотландия, Уэльс)."""
+    return '\U0001F3F4' + ''.join(chr(0xE0000 + ord(ch)) for ch in code) + '\U000E007F'
+
+# alpha-2 | ISO alpha-3 и коды МОК/ФИФА, если отличаются | английское название (alt-текст флага в Википедии)
+COUNTRY_CODES = """
+AE ARE UAE|United Arab Emirates
+AF AFG|Afghanistan
+AL ALB|Albania
+AR ARG|Argentina
+AT AUT|Austria
+AU AUS|Australia
+AZ AZE|Azerbaijan
+BA BIH|Bosnia and Herzegovina
+BE BEL|Belgium
+BG BGR BUL|Bulgaria
+BH BHR BRN|Bahrain
+BR BRA|Brazil
+BY BLR|Belarus
+CA CAN|Canada
+CH CHE SUI|Switzerland
+CL CHL CHI|Chile
+CN CHN|China,People's Republic of China
+CO COL|Colombia
+CY CYP|Cyprus
+CZ CZE|Czech Republic,Czechia
+DE DEU GER|Germany
+DK DNK DEN|Denmark
+DZ DZA ALG|Algeria
+EE EST|Estonia
+EG EGY|Egypt
+ES ESP|Spain
+FI FIN|Finland
+FR FRA|France
+GB GBR|United Kingdom,Great Britain
+GE GEO|Georgia
+GI GIB|Gibraltar
+GR GRC GRE|Greece
+HK HKG|Hong Kong
+HR HRV CRO|Croatia
+HU HUN|Hungary
+ID IDN INA|Indonesia
+IE IRL|Ireland,Republic of Ireland
+IL ISR|Israel
+IM IMN|Isle of Man
+IN IND|India
+IQ IRQ|Iraq
+IR IRN|Iran
+IS ISL|Iceland
+IT ITA|Italy
+JE JEY|Jersey
+JO JOR|Jordan
+JP JPN|Japan
+KG KGZ|Kyrgyzstan
+KR KOR|South Korea,Korea
+KW KWT KUW|Kuwait
+KZ KAZ|Kazakhstan
+LB LBN LIB|Lebanon
+LI LIE|Liechtenstein
+LT LTU|Lithuania
+LU LUX|Luxembourg
+LV LVA LAT|Latvia
+LY LBY|Libya
+MA MAR|Morocco
+MD MDA|Moldova
+MK MKD|North Macedonia
+MO MAC|Macau,Macao
+MT MLT|Malta
+MX MEX|Mexico
+MY MYS MAS|Malaysia
+NL NLD NED|Netherlands
+NO NOR|Norway
+NZ NZL|New Zealand
+OM OMN|Oman
+PH PHL PHI|Philippines
+PK PAK|Pakistan
+PL POL|Poland
+PT PRT POR|Portugal
+QA QAT|Qatar
+RO ROU|Romania
+RS SRB|Serbia
+RU RUS|Russia
+SA SAU KSA|Saudi Arabia
+SE SWE|Sweden
+SG SGP|Singapore
+SI SVN SLO|Slovenia
+SK SVK|Slovakia
+SY SYR|Syria
+TH THA|Thailand
+TN TUN|Tunisia
+TR TUR|Turkey,Türkiye
+TW TWN TPE|Taiwan,Chinese Taipei
+UA UKR|Ukraine
+US USA|United States
+UZ UZB|Uzbekistan
+VN VNM VIE|Vietnam
+ZA ZAF RSA|South Africa
+"""
+
+# Флаги частей Великобритании: у Северной Ирландии своего эмодзи нет, берём британский
+SUBDIVISION_FLAGS = {
+    'gbeng': ('ENG', 'England'),
+    'gbsct': ('SCO', 'SCT', 'Scotland'),
+    'gbwls': ('WAL', 'WLS', 'Wales'),
 }
+EXTRA_FLAG_KEYS = {'GB': ('NIR', 'Northern Ireland')}
 
-# === Получение информации о турнирах с флагами ===
-def get_schedule_tournaments():
+def build_flag_table():
+    """Код или alt-текст (в верхнем регистре) -> готовая строка эмодзи."""
+    table = {}
+    for line in COUNTRY_CODES.strip().splitlines():
+        codes, names = line.split('|')
+        codes = codes.split()
+        emoji = alpha2_to_emoji(codes[0])
+        for key in codes + names.split(','):
+            table[key.upper()] = emoji
+    for code, keys in SUBDIVISION_FLAGS.items():
+        for key in keys:
+            table[key.upper()] = subdivision_emoji(code)
+    for alpha2, keys in EXTRA_FLAG_KEYS.items():
+        for key in keys:
+            table[key.upper()] = alpha2_to_emoji(alpha2)
+    return table
+
+FLAG_EMOJI = build_flag_table()
+
+def cell_flag(cell):
+    """Эмодзи флага из span.flagicon ячейки таблицы или ''."""
+    span = cell.find('span', class_='flagicon')
+    img = span.find('img') if span else None
+    if img is None or 'alt' not in img.attrs:
+        return ''
+    return FLAG_EMOJI.get(img['alt'].strip().upper(), '')
+
+# === HTTP-транспорт: live / record / replay ===
+# live   — обычные запросы в сеть (по умолчанию)
+# record — запросы в сеть + ответ с заголовками сохраняется в кассету
+# replay — сеть не трогаем, отдаём ответ из кассеты с искусственной задержкой и ошибками
+HTTP_MODE = os.getenv("SNOOKER_HTTP_MODE", "live")
+CASSETTE_DIR = os.getenv("SNOOKER_CASSETTE_DIR", "cassettes")
+REPLAY_LATENCY = float(os.getenv("SNOOKER_REPLAY_LATENCY", "0"))  # секунды на ответ
+REPLAY_ERROR_RATE = float(os.getenv("SNOOKER_REPLAY_ERROR_RATE", "0"))  # доля ответов с ошибкой, 0..1
+
+def set_http_mode(mode, cassette_dir=None, latency=None, error_rate=None):
+    """Переключает транспорт на лету (для бенчмарков и отладки)."""
+    global HTTP_MODE, CASSETTE_DIR, REPLAY_LATENCY, REPLAY_ERROR_RATE
+    if mode not in ('live', 'record', 'replay'):
+        raise ValueError(f"Неизвестный режим HTTP: {mode}")
+    HTTP_MODE = mode
+    if cassette_dir is not None:
+        CASSETTE_DIR = cassette_dir
+    if latency is not None:
+        REPLAY_LATENCY = latency
+    if error_rate is not None:
+        REPLAY_ERROR_RATE = error_rate
+
+def cassette_path(url):
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(CASSETTE_DIR, f"{name}.json")
+
+def save_cassette(url, status_code, headers, body):
+    os.makedirs(CASSETTE_DIR, exist_ok=True)
+    with open(cassette_path(url), 'w', encoding='utf-8') as f:
+        json.dump({
+            'url': url,
+            'status_code': status_code,
+            'headers': dict(headers),
+            'body': body,
+        }, f, ensure_ascii=False)
+
+def replay_response(url, timeout=None, headers=None):
+    path = cassette_path(url)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    else:  # не записанный адрес — как 404, а не сбой хоста, чтобы не размыкать предохранитель
+        record = {'status_code': 404, 'headers': {}, 'body': ''}
+
+    if REPLAY_LATENCY:
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and REPLAY_LATENCY > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.Timeout(f"Replay: ответ дольше таймаута {read_timeout} с")
+        time.sleep(REPLAY_LATENCY)
+    if REPLAY_ERROR_RATE and random.random() < REPLAY_ERROR_RATE:
+        raise requests.ConnectionError(f"Replay: искусственная ошибка для {url}")
+
+    response = requests.Response()
+    response.url = url
+    response.status_code = record['status_code']
+    response.headers.update(record['headers'])
+    response.encoding = 'utf-8'
+    response._content = record['body'].encode('utf-8')
+    # условный GET, как у настоящего сервера: совпал ETag — 304 без тела
+    etag = response.headers.get('ETag')
+    if etag and (headers or {}).get('If-None-Match') == etag:
+        response.status_code = 304
+        response._content = b''
+    return response
+
+def page_label(url):
+    """Короткое имя страницы для меток метрик: последний сегмент пути."""
+    return urlparse(url).path.rsplit('/', 1)[-1] or urlparse(url).netloc
+
+# === Политика загрузки: таймауты, повторы, предохранитель, хеджирование ===
+# Каждый GET идёт с таймаутами на соединение и чтение, урезанными до остатка FETCH_DEADLINE;
+# тело читается потоком и тоже обрывается по сроку (таймаут чтения requests — на каждый кусок,
+# а не на всё тело). Сетевые ошибки, 5xx и 429 повторяются с экспоненциальной паузой и полным
+# джиттером, пока укладываемся в срок. Поверх этого fetch_budget задаёт общий срок на все запросы
+# потока — им resolve_records ограничивает опрос всех провайдеров разом. Подряд FETCH_BREAKER_THRESHOLD неудач по хосту размыкают предохранитель:
+# FETCH_BREAKER_COOLDOWN секунд запросы к хосту сразу падают с CircuitOpenError, а
+# fetch_html отдаёт последнюю загруженную копию. Потом пропускается один пробный запрос.
+# С FETCH_HEDGE, если ответа нет дольше p95 задержки хоста, параллельно уходит второй запрос.
+FETCH_TIMEOUT = (float(os.getenv("FETCH_CONNECT_TIMEOUT", "5")), float(os.getenv("FETCH_READ_TIMEOUT", "15")))
+FETCH_RETRIES = 2
+FETCH_BACKOFF = 0.5           # секунды, база экспоненциальной паузы
+FETCH_DEADLINE = 30           # секунды на все попытки одного http_get, включая чтение тела
+FETCH_CHUNK = 64 * 1024
+FETCH_BREAKER_THRESHOLD = 5
+FETCH_BREAKER_COOLDOWN = 60
+FETCH_HEDGE = os.getenv("SNOOKER_FETCH_HEDGE", "0") == "1"
+FETCH_HEDGE_MIN_SAMPLES = 20
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_breakers = {}          # хост -> {'failures', 'opened_at'}
+_host_latencies = {}    # хост -> deque последних длительностей успешных ответов
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')
+_fetch_budget = threading.local()  # .deadline — общий срок (time.monotonic) для http_get этого потока
+
+class CircuitOpenError(requests.ConnectionError):
+    """Предохранитель хоста разомкнут: запрос не отправлялся."""
+
+class FetchBudgetExceeded(requests.Timeout):
+    """Общий срок fetch_budget вышел: запрос не отправлялся."""
+
+@contextlib.contextmanager
+def fetch_budget(seconds):
+    """Общий срок на все http_get потока; вложенный бюджет внешний не продлевает."""
+    outer = getattr(_fetch_budget, 'deadline', None)
+    deadline = time.monotonic() + seconds
+    _fetch_budget.deadline = deadline if outer is None else min(deadline, outer)
     try:
-        url = "https://en.wikipedia.org/wiki/2025%E2%80%9326_snooker_season"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        tables = soup.find_all('table', {'class': 'wikitable'})
-        target_table = None
-        for table in tables:
-            header = table.find('tr')
-            headers = [th.get_text(strip=True) for th in header.find_all(['th', 'td'])]
-            if {'Start', 'Finish', 'Tournament', 'Venue', 'Winner', 'Runner-up', 'Score'}.issubset(set(headers)):
-                target_table = table
-                break
+        yield _fetch_budget.deadline
+    finally:
+        _fetch_budget.deadline = outer
 
-        if not target_table:
-            return []
+def breaker_allows(host):
+    state = _breakers.get(host)
+    if not state or state['failures'] < FETCH_BREAKER_THRESHOLD:
+        return True
+    if time.monotonic() - state['opened_at'] >= FETCH_BREAKER_COOLDOWN:
+        state['opened_at'] = time.monotonic()  # пробный запрос; при неудаче снова ждём cooldown
+        return True
+    return False
 
-        rows = target_table.find_all('tr')[1:]
-        tournaments = []
-        for row in rows:
-            cols = row.find_all('td')
-            if len(cols) >= 7:
-                start_str = cols[0].get_text(strip=True)
-                finish_str = cols[1].get_text(strip=True)
-                tournament = cols[2].get_text(strip=True)
-                venue = cols[3].get_text(separator=" ", strip=True)
-
-                # Парсим победителя и флаг
-                winner_cell = cols[4]
-                winner_name = winner_cell.get_text(strip=True)
-                winner_flag_emoji = ''
-                winner_flag_span = winner_cell.find('span', class_='flagicon')
-                if winner_flag_span:
-                    img = winner_flag_span.find('img')
-                    if img and 'alt' in img.attrs:
-                        alt_code = img['alt'].strip().upper()
-                        alpha2 = alpha3_to_alpha2.get(alt_code, '')
-                        if alpha2:
-                            winner_flag_emoji = alpha2_to_emoji(alpha2)
-
-                # Парсим финалиста и флаг
-                runner_cell = cols[6]
-                runner_name = runner_cell.get_text(strip=True)
-                runner_flag_emoji = ''
-                runner_flag_span = runner_cell.find('span', class_='flagicon')
-                if runner_flag_span:
-                    img = runner_flag_span.find('img')
-                    if img and 'alt' in img.attrs:
-                        alt_code = img['alt'].strip().upper()
-                        alpha2 = alpha3_to_alpha2.get(alt_code, '')
-                        if alpha2:
-                            runner_flag_emoji = alpha2_to_emoji(alpha2)
-
-                score = cols[5].get_text(strip=True)
-
-                start_date = parse_start_finish_date(start_str)
-                finish_date = parse_start_finish_date(finish_str)
-
-                if start_date is None:
-                    continue
+def breaker_record(host, ok):
+    state = _breakers.setdefault(host, {'failures': 0, 'opened_at': 0})
+    if ok:
+        state['failures'] = 0
+        return
+    state['failures'] += 1
+    if state['failures'] == FETCH_BREAKER_THRESHOLD:
+        state['opened_at'] = time.monotonic()
+        inc_counter('snooker_circuit_open_total', host=host)
+        logging.warning(f"Предохранитель для {host} разомкнут на {FETCH_BREAKER_COOLDOWN} с")
 
-                tournaments.append({
-                    'start': start_date,
-                    'finish': finish_date,
-                    'tournament': tournament,
-                    'venue': venue,
-                    'winner': f"{winner_flag_emoji} {winner_name}" if winner_flag_emoji else winner_name,
-                    'runner_up': f"{runner_flag_emoji} {runner_name}" if runner_flag_emoji else runner_name,
-                    'score': score,
-                    'start_str': start_str,
-                    'finish_str': finish_str,
-                })
-
-        tournaments.sort(key=lambda x: x['start'])
-
-        # --- Ролл списка, чтобы сезон начинался с июня ---
-        june_index = None
-        for i, t in enumerate(tournaments):
-            if t['start'].month >= 6:
-                june_index = i
+def hedge_delay(host):
+    """p95 длительности ответов хоста или None, если замеров пока мало."""
+    samples = _host_latencies.get(host)
+    if not samples or len(samples) < FETCH_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(len(ordered) * 0.95) - 1]
+
+def read_body(response, deadline):
+    """Читает тело ответа целиком, но не дольше deadline.
+
+    read1 отдаёт то, что уже пришло, — iter_content ждал бы полный кусок, и сервер,
+    присылающий по байту, растянул бы чтение далеко за срок.
+    """
+    chunks = []
+    try:
+        while True:
+            chunk = response.raw.read1(FETCH_CHUNK, decode_content=True)
+            if not chunk:
                 break
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f"Тело {page_label(response.url)} не загрузилось в срок")
+    except urllib3.exceptions.ReadTimeoutError as e:
+        raise requests.Timeout(e) from e
+    except (urllib3.exceptions.ProtocolError, urllib3.exceptions.DecodeError) as e:
+        raise requests.ConnectionError(e) from e
+    finally:
+        response.close()
+    response._content = b''.join(chunks)
+
+def send_once(url, timeout, headers, deadline):
+    if HTTP_MODE == 'replay':
+        return replay_response(url, timeout=timeout, headers=headers)
+    response = requests.get(url, timeout=timeout, headers=headers, stream=True)
+    read_body(response, deadline)
+    if HTTP_MODE == 'record':
+        save_cassette(url, response.status_code, response.headers, response.text)
+    return response
+
+def send_hedged(url, timeout, headers, delay, deadline):
+    """Первый запрос; если он не ответил за delay — второй, берём первый успешный."""
+    first = _hedge_pool.submit(send_once, url, timeout, headers, deadline)
+    try:
+        return first.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    inc_counter('snooker_fetch_hedged_total', page=page_label(url))
+    pending = {first, _hedge_pool.submit(send_once, url, timeout, headers, deadline)}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+    raise error
+
+def http_get(url, timeout=None, headers=None):
+    """Единая точка для всех GET-запросов бота: таймауты, повторы, предохранитель."""
+    host = urlparse(url).netloc
+    timeout = timeout or FETCH_TIMEOUT
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    t0 = time.perf_counter()
+    deadline = time.monotonic() + FETCH_DEADLINE
+    budget = getattr(_fetch_budget, 'deadline', None)
+    if budget is not None:
+        deadline = min(deadline, budget)
+    try:
+        if budget is not None and time.monotonic() >= budget:
+            raise FetchBudgetExceeded(f"Общий срок вышел, {page_label(url)} не запрашиваю")
+        if not breaker_allows(host):
+            raise CircuitOpenError(f"Предохранитель для {host} разомкнут")
+        for attempt in range(FETCH_RETRIES + 1):
+            started = time.perf_counter()
+            remaining = deadline - time.monotonic()
+            attempt_timeout = tuple(min(t, remaining) for t in timeout)
+            try:
+                delay = hedge_delay(host) if FETCH_HEDGE else None
+                if delay:
+                    response = send_hedged(url, attempt_timeout, headers, min(delay, remaining), deadline)
+                else:
+                    response = send_once(url, attempt_timeout, headers, deadline)
+                if response.status_code not in RETRY_STATUSES:
+                    breaker_record(host, True)
+                    _host_latencies.setdefault(host, deque(maxlen=200)).append(time.perf_counter() - started)
+                    return response
+                error = requests.HTTPError(f"{response.status_code} для {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            breaker_record(host, False)
+            pause = random.uniform(0, FETCH_BACKOFF * 2 ** attempt)
+            if attempt == FETCH_RETRIES or time.monotonic() + pause >= deadline or not breaker_allows(host):
+                raise error
+            time.sleep(pause)
+    except Exception:
+        inc_counter('snooker_fetch_errors_total', page=page_label(url))
+        raise
+    finally:
+        observe('snooker_fetch_duration_seconds', time.perf_counter() - t0, page=page_label(url))
+
+# === Загрузка страниц ===
+RANKING_URL = f"{WIKI_BASE_URL}/wiki/Snooker_world_rankings"
+
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "300"))  # секунды; 0 — без кэша
+_page_cache = {}  # url -> (время загрузки, html)
+
+def fetch_html(url):
+    """HTML страницы; повторные запросы в пределах PAGE_CACHE_TTL берутся из памяти."""
+    cached = _page_cache.get(url)
+    if cached and time.monotonic() - cached[0] < PAGE_CACHE_TTL:
+        record_cache('page', True)
+        return cached[1]
+    record_cache('page', False)
+    try:
+        response = http_get(url)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if cached:  # предохранитель разомкнут или хост не отвечает — отдаём последнюю копию
+            logging.warning(f"Отдаю сохранённую копию {page_label(url)}: {e}")
+            record_cache('page_stale', True)
+            return cached[1]
+        raise
+    _page_cache[url] = (time.monotonic(), response.text)
+    return response.text
+
+# === MediaWiki API: только нужный раздел статьи ===
+# Вместо всей статьи (навигация, сноски, все таблицы) берём один раздел через
+# action=parse&section=N. Номер раздела ищется один раз по заголовкам (prop=sections)
+# и кэшируется; перед загрузкой текста сверяем revid — не изменился, значит не качаем.
+# Если API не ответил, за ту же таблицу отвечает провайдер полной страницы (см. PROVIDERS).
+WIKI_API_URL = os.getenv("WIKI_API_URL", f"{WIKI_BASE_URL}/w/api.php")
+CALENDAR_SECTION_HINTS = ('calendar', 'schedule')
+RANKING_SECTION_HINTS = ('current ranking', 'ranking')
+
+_api_sections = {}   # название статьи -> номер раздела с таблицей
+_api_revisions = {}  # название статьи -> (время проверки, revid, html раздела)
+
+def page_title(url):
+    return unquote(urlparse(url).path.rsplit('/', 1)[-1])
+
+def wiki_api_parse(title, **params):
+    query = urlencode({'action': 'parse', 'page': title, 'format': 'json', 'formatversion': 2, **params})
+    response = http_get(f"{WIKI_API_URL}?{query}")
+    response.raise_for_status()
+    data = response.json()
+    if 'error' in data:
+        raise requests.RequestException(f"MediaWiki API: {data['error'].get('info')}")
+    return data['parse']
+
+def locate_section(title, hints):
+    """Номер первого раздела, в заголовке которого есть одна из подсказок, или None."""
+    for section in wiki_api_parse(title, prop='sections')['sections']:
+        line = section['line'].lower()
+        if any(hint in line for hint in hints):
+            return section['index']
+    return None
+
+def fetch_section_html(url, hints):
+    title = page_title(url)
+    cached = _api_revisions.get(title)
+    if cached and time.monotonic() - cached[0] < PAGE_CACHE_TTL:
+        record_cache('page', True)
+        return cached[2]
+    revid = wiki_api_parse(title, prop='revid')['revid']
+    if cached and cached[1] == revid:
+        record_cache('wiki_revision', True)
+        _api_revisions[title] = (time.monotonic(), revid, cached[2])
+        return cached[2]
+    record_cache('wiki_revision', False)
+    if title not in _api_sections:
+        _api_sections[title] = locate_section(title, hints)
+    if _api_sections[title] is None:
+        html = fetch_html(url)
+    else:
+        html = wiki_api_parse(title, prop='text', section=_api_sections[title])['text']
+    _api_revisions[title] = (time.monotonic(), revid, html)
+    return html
+
+def fetch_table_html(url, hints):
+    """HTML раздела с таблицей; при сбое API — последний загруженный раздел, если он есть."""
+    try:
+        return fetch_section_html(url, hints)
+    except requests.RequestException as e:
+        cached = _api_revisions.get(page_title(url))
+        if not cached:
+            raise
+        logging.warning(f"Отдаю сохранённый раздел {page_title(url)}: {e}")
+        record_cache('page_stale', True)
+        return cached[2]
+
+def forget_section(url):
+    """Таблицы в закэшированном разделе нет (статью переставили) — в следующий раз ищем заново."""
+    title = page_title(url)
+    _api_sections.pop(title, None)
+    _api_revisions.pop(title, None)
+
+# === Получение информации о турнирах с флагами ===
+# Дерево всей статьи для календаря не строится: таблицы режутся по тегам прямо в HTML,
+# отпечаток считается по сырой разметке <tr>, и в BeautifulSoup попадают только заголовок
+# таблицы и строки, которых не было в прошлом разборе.
+CALENDAR_HEADERS = {'Start', 'Finish', 'Tournament', 'Venue', 'Winner', 'Runner-up', 'Score'}
+WIKITABLE_RE = re.compile(r'<table\b[^>]*\bclass="[^"]*\bwikitable\b[^"]*"[^>]*>', re.IGNORECASE)
+TABLE_TAG_RE = re.compile(r'<(/?)(table|tr)\b[^>]*>', re.IGNORECASE)
+
+def table_row_markup(html, pos):
+    """Строки <tr> таблицы, открытой в html[pos], как сырая разметка, и позиция конца таблицы.
+
+    Строки вложенных таблиц в список не попадают — они остаются внутри своей ячейки.
+    """
+    depth = 0
+    rows = []
+    row_start = None
+    for m in TABLE_TAG_RE.finditer(html, pos):
+        closing, tag = m.group(1), m.group(2).lower()
+        if tag == 'table':
+            depth += -1 if closing else 1
+            if depth == 0:
+                if row_start is not None:  # </tr> необязателен
+                    rows.append(html[row_start:m.start()])
+                return rows, m.end()
+        elif depth == 1:
+            if row_start is not None:
+                rows.append(html[row_start:m.end() if closing else m.start()])
+                row_start = None
+            if not closing:
+                row_start = m.start()
+    return rows, len(html)
+
+def is_calendar_header(row):
+    cells = BeautifulSoup(row, 'html.parser').find_all(['th', 'td'])
+    return CALENDAR_HEADERS.issubset({cell.get_text(strip=True) for cell in cells})
+
+def schedule_row_markup(html):
+    """Строки таблицы календаря без заголовка, как сырая разметка, или None, если таблицы нет."""
+    pos = 0
+    while (m := WIKITABLE_RE.search(html, pos)) is not None:
+        rows, pos = table_row_markup(html, m.start())
+        if rows and is_calendar_header(rows[0]):
+            return rows[1:]
+    return None
+
+_schedule_rows = {}  # год начала -> {отпечаток строки: турнир} последнего разбора
+
+def row_fingerprint(markup):
+    """Хэш сырой разметки строки: совпал — ячейки те же, строку можно не разбирать."""
+    return hashlib.sha1(markup.encode('utf-8')).hexdigest()
+
+def extract_schedule_rows(rows, season_start):
+    """Разбирает строки календаря сезона season_start (сырая разметка <tr>) в список турниров по дате начала.
+
+    Строки с тем же отпечатком, что и в прошлый раз, берутся готовыми из _schedule_rows и в суп не попадают.
+    """
+    tournaments = []
+    flags = {}  # имя игрока -> эмодзи флага
+    previous = _schedule_rows.get(season_start, {})
+    parsed = {}
+    for markup in rows:
+        fingerprint = row_fingerprint(markup)
+        if fingerprint in previous:
+            parsed[fingerprint] = previous[fingerprint]
+            tournaments.append(previous[fingerprint])
+            continue
+        cols = BeautifulSoup(markup, 'html.parser').find_all('td')
+        if len(cols) >= 7:
+            start_str = cols[0].get_text(strip=True)
+            finish_str = cols[1].get_text(strip=True)
+            tournament = cols[2].get_text(strip=True)
+            article = cols[2].find('a', href=re.compile(r'^/wiki/'))
+            venue = cols[3].get_text(separator=" ", strip=True)
 
-        if june_index is not None and june_index > 0:
-            tournaments = tournaments[june_index:] + tournaments[:june_index]
+            # Флаг ищем один раз на игрока за разбор: в календаре одни и те же имена повторяются
+            winner_cell, runner_cell = cols[4], cols[6]
+            winner_name = winner_cell.get_text(strip=True)
+            runner_name = runner_cell.get_text(strip=True)
+            if winner_name not in flags:
+                flags[winner_name] = cell_flag(winner_cell)
+            if runner_name not in flags:
+                flags[runner_name] = cell_flag(runner_cell)
+            winner_flag_emoji = flags[winner_name]
+            runner_flag_emoji = flags[runner_name]
 
+            score = cols[5].get_text(strip=True)
+
+            start_date = parse_start_finish_date(start_str, season_start)
+            finish_date = parse_start_finish_date(finish_str, season_start)
+
+            if start_date is None:
+                continue
+
+            parsed[fingerprint] = {
+                'fingerprint': fingerprint,
+                'start': start_date,
+                'finish': finish_date,
+                'tournament': tournament,
+                'venue': venue,
+                'winner': f"{winner_flag_emoji} {winner_name}" if winner_flag_emoji else winner_name,
+                'runner_up': f"{runner_flag_emoji} {runner_name}" if runner_flag_emoji else runner_name,
+                'winner_name': winner_name,
+                'runner_up_name': runner_name,
+                'winner_flag': winner_flag_emoji,
+                'runner_up_flag': runner_flag_emoji,
+                # только id сносок; URL достаются из ol.references лениво, когда просят ссылки
+                'ref_ids': [a['href'][1:] for a in cols[7].select('sup a[href^="#"]')] if len(cols) >= 8 else [],
+                'article_url': WIKI_BASE_URL + article['href'] if article else None,
+                'score': score,
+                'start_str': start_str,
+                'finish_str': finish_str,
+            }
+            tournaments.append(parsed[fingerprint])
+
+    _schedule_rows[season_start] = parsed
+    # год у дат уже с учётом сезона, так что сортировка сразу идёт от июня к маю
+    tournaments.sort(key=lambda x: x['start'])
+    return tournaments
+
+def schedule_from_html(html, season_start):
+    rows = schedule_row_markup(html)
+    return extract_schedule_rows(rows, season_start) if rows is not None else []
+
+def scrape_season(season_start):
+    """Календарь сезона от самого быстрого исправного провайдера."""
+    return resolve_records('schedule', season_start)
+
+# --- Завершённые сезоны: результаты больше не меняются, кэшируем навсегда ---
+_past_seasons = {}  # год начала -> турниры
+
+def season_cache_path(season_start):
+    return os.path.join(SEASONS_DIR, f"{season_label(season_start)}.json")
+
+def tournaments_to_json(tournaments):
+    return [
+        {**t, 'start': t['start'].isoformat(), 'finish': t['finish'].isoformat() if t['finish'] else None}
+        for t in tournaments
+    ]
+
+def tournaments_from_json(data):
+    return [
+        {
+            **t,
+            'start': datetime.fromisoformat(t['start']).date(),
+            'finish': datetime.fromisoformat(t['finish']).date() if t['finish'] else None,
+        }
+        for t in data
+    ]
+
+def load_past_season(season_start):
+    """Прошедший сезон: память -> файл в SEASONS_DIR -> Википедия (один раз, затем на диск)."""
+    if season_start in _past_seasons:
+        record_cache('past_season', True)
+        return _past_seasons[season_start]
+
+    path = season_cache_path(season_start)
+    if os.path.exists(path):
+        record_cache('past_season', True)
+        with open(path, 'r', encoding='utf-8') as f:
+            tournaments = tournaments_from_json(json.load(f))
+        _past_seasons[season_start] = tournaments
         return tournaments
+
+    record_cache('past_season', False)
+    tournaments = scrape_season(season_start)
+    if tournaments:
+        os.makedirs(SEASONS_DIR, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(tournaments_to_json(tournaments), f, ensure_ascii=False)
+        _past_seasons[season_start] = tournaments
+    return tournaments
+
+# --- Текущий и следующий сезон: последний удачный разбор на случай сбоя Википедии ---
+_season_snapshots = {}  # год начала -> турниры
+_schedule_changes = deque()  # наборы изменений календаря, ждущие рассылки
+
+def schedule_changes(previous, tournaments):
+    """Набор изменений между снимками: [(вид, новый турнир, старый турнир)].
+
+    Строки сравниваются по отпечаткам, так что работа идёт только по изменившимся.
+    Виды: 'winner' — появился победитель, 'score' — исправлен счёт,
+    'dates' — сдвинулись даты, 'venue' — сменилось место.
+    """
+    unchanged = {t.get('fingerprint') for t in previous} & {t.get('fingerprint') for t in tournaments}
+    before = {t['tournament']: t for t in previous if t.get('fingerprint') not in unchanged}
+    changes = []
+    for t in tournaments:
+        if t.get('fingerprint') in unchanged:
+            continue
+        old = before.get(t['tournament'])
+        if old is None:
+            continue
+        if t['winner_name'] and not old['winner_name']:
+            changes.append(('winner', t, old))
+        elif t['winner_name'] and t['score'] != old['score']:
+            changes.append(('score', t, old))
+        if (t['start'], t['finish']) != (old['start'], old['finish']):
+            changes.append(('dates', t, old))
+        if t['venue'] != old['venue']:
+            changes.append(('venue', t, old))
+    return changes
+
+def get_schedule_tournaments(season_start=None):
+    if season_start is None:
+        season_start = current_season()
+    try:
+        if season_start < current_season():
+            return load_past_season(season_start)
+        tournaments = scrape_season(season_start)
     except Exception as e:
         logging.error(f"Ошибка в get_schedule_tournaments: {e}")
-        return []
+        tournaments = []
+    if tournaments:
+        previous = _season_snapshots.get(season_start)
+        if tournaments == previous:
+            return previous  # тот же снимок: кэши по снимку остаются в силе
+        if previous and season_start == current_season() and is_leader():  # рассылает только лидер
+            changes = schedule_changes(previous, tournaments)
+            if changes:
+                _schedule_changes.append(changes)
+        _season_snapshots[season_start] = tournaments
+        if season_start == current_season():
+            notify_schedule_snapshot(tournaments)
+        return tournaments
+    return _season_snapshots.get(season_start, [])
+
+async def prefetch_next_season(context: ContextTypes.DEFAULT_TYPE):
+    """Ежедневно в последние SEASON_PREFETCH_DAYS дней сезона проверяет страницу следующего."""
+    today = datetime.now(LOCAL_TZ).date()
+    next_season = current_season(today) + 1
+    rollover = datetime(next_season, SEASON_START_MONTH, 1).date()
+    if (rollover - today).days > SEASON_PREFETCH_DAYS:
+        return
+    try:
+        tournaments = await asyncio.to_thread(scrape_season, next_season)
+    except Exception as e:
+        logging.warning(f"Не удалось подгрузить сезон {season_label(next_season)}: {e}")
+        return
+    if tournaments:
+        _season_snapshots[next_season] = tournaments
+        logging.info(f"Сезон {season_label(next_season)} готов: {len(tournaments)} турниров")
+    else:
+        logging.warning(f"На странице сезона {season_label(next_season)} пока нет календаря")
 
 # === Получение расписания турниров (возвращает строку) ===
-def get_schedule():
+_rendered_rows = {}  # отпечаток строки -> готовый текст турнира
+
+def render_tournament(t):
+    return (
+        f"📅 {t['start_str']} — {t['finish_str']}\n"
+        f"🏆 {t['tournament']}\n"
+        f"📍 {t['venue']}\n"
+        f"🥇 Победитель: {t['winner']}\n"
+        f"🥈 Финалист: {t['runner_up']}\n"
+        f"⚔️ Счёт финала: {t['score']}"
+    )
+
+def render_schedule(tournaments):
+    """Текст календаря; турниры из неизменившихся строк не перерисовываются."""
+    results = []
+    rendered = {}
+    for t in tournaments:
+        fingerprint = t.get('fingerprint')
+        text = _rendered_rows.get(fingerprint) if fingerprint else None
+        if text is None:
+            text = render_tournament(t)
+        if fingerprint:
+            rendered[fingerprint] = text
+        results.append(text)
+    if rendered:
+        _rendered_rows.clear()  # держим только строки последнего снимка
+        _rendered_rows.update(rendered)
+    return "\n\n".join(results)
+
+def get_schedule(season_start=None):
     try:
-        tournaments = get_schedule_tournaments()
+        tournaments = get_schedule_tournaments(season_start)
         if not tournaments:
             return "Нет данных о турнирах."
-
-        results = []
-        for t in tournaments:
-            results.append(
-                f"📅 {t['start_str']} — {t['finish_str']}\n"
-                f"🏆 {t['tournament']}\n"
-                f"📍 {t['venue']}\n"
-                f"🥇 Победитель: {t['winner']}\n"
-                f"🥈 Финалист: {t['runner_up']}\n"
-                f"⚔️ Счёт финала: {t['score']}"
-            )
-        return "\n\n".join(results)
+        return render_schedule(tournaments)
     except Exception as e:
         return f"Ошибка при получении расписания: {e}"
 
+# === Ссылки на источники (сноски календаря) ===
+# Карта «id сноски -> URL» строится только из ol.references и только когда пользователь
+# просит ссылки. Берётся тот же HTML, из которого разобраны строки (_schedule_sources):
+# у раздела через mediawiki_api свой список сносок и своя нумерация, с полной статьёй она
+# не совпадает. Готовые фрагменты ссылок кэшируются на снимок календаря и режим разметки.
+LINKS_ARGS = {'links', 'ссылки'}
+MARKDOWN_V2_SPECIAL = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+
+_ref_fragments = {}  # (год начала, parse_mode) -> (снимок турниров, [фрагмент на турнир])
+_schedule_sources = {}  # (год начала, провайдер) -> (турниры, HTML, из которого они разобраны)
+
+def remember_schedule_source(season_start, provider, tournaments, html):
+    if tournaments:
+        _schedule_sources[(season_start, provider)] = (tournaments, html)
+    return tournaments
+
+def schedule_source_html(season_start, tournaments):
+    """HTML, из которого разобран снимок; для снимка неизвестного происхождения — полная статья."""
+    for (season, _), (records, html) in list(_schedule_sources.items()):
+        if season == season_start and records == tournaments:
+            return html
+    return fetch_html(season_url(season_start))
+
+def parse_ref_links(html):
+    """id сноски -> первый внешний URL из её текста."""
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('ol', class_='references'))
+    links = {}
+    for li in soup.find_all('li', id=True):
+        a = li.find('a', href=re.compile(r'^(https?:)?//'))
+        if a:
+            href = a['href']
+            links[li['id']] = 'https:' + href if href.startswith('//') else href
+    return links
+
+def escape_text(text, parse_mode):
+    if parse_mode == 'HTML':
+        return html_lib.escape(text, quote=False)
+    if parse_mode == 'MarkdownV2':
+        return MARKDOWN_V2_SPECIAL.sub(r'\\\1', text)
+    return text
+
+def render_link(label, url, parse_mode):
+    if parse_mode == 'HTML':
+        return f'<a href="{html_lib.escape(url, quote=True)}">{html_lib.escape(label, quote=False)}</a>'
+    # в MarkdownV2 внутри (...) экранируются только ')' и '\'
+    url = url.replace('\\', '\\\\').replace(')', '\\)')
+    return f"[{escape_text(label, parse_mode)}]({url})"
+
+def schedule_link_fragments(season_start, tournaments, parse_mode):
+    """Фрагменты ссылок для каждого турнира снимка (пустая строка, если сносок нет)."""
+    cached = _ref_fragments.get((season_start, parse_mode))
+    if cached and cached[0] is tournaments:
+        return cached[1]
+    links = parse_ref_links(schedule_source_html(season_start, tournaments))
+    fragments = []
+    for t in tournaments:
+        urls = [links[i] for i in t.get('ref_ids', []) if i in links]
+        fragments.append(", ".join(
+            render_link("Источник" if n == 0 else f"[{n + 1}]", url, parse_mode) for n, url in enumerate(urls)
+        ))
+    _ref_fragments[(season_start, parse_mode)] = (tournaments, fragments)
+    return fragments
+
+def render_schedule_with_links(tournaments, fragments, parse_mode):
+    results = []
+    for t, links in zip(tournaments, fragments):
+        e = functools.partial(escape_text, parse_mode=parse_mode)
+        text = (
+            f"📅 {e(t['start_str'])} — {e(t['finish_str'])}\n"
+            f"🏆 {e(t['tournament'])}\n"
+            f"📍 {e(t['venue'])}\n"
+            f"🥇 Победитель: {e(t['winner'])}\n"
+            f"🥈 Финалист: {e(t['runner_up'])}\n"
+            f"⚔️ Счёт финала: {e(t['score'])}"
+        )
+        if links:
+            text += f"\n🔗 {links}"
+        results.append(text)
+    return "\n\n".join(results)
+
+def get_schedule_with_links(season_start=None, parse_mode='HTML'):
+    """Календарь со ссылками на источники в разметке parse_mode ('HTML' или 'MarkdownV2')."""
+    if season_start is None:
+        season_start = current_season()
+    try:
+        tournaments = get_schedule_tournaments(season_start)
+        if not tournaments:
+            return "Нет данных о турнирах."
+        fragments = schedule_link_fragments(season_start, tournaments, parse_mode)
+        return render_schedule_with_links(tournaments, fragments, parse_mode)
+    except Exception as e:
+        return escape_text(f"Ошибка при получении расписания: {e}", parse_mode)
+
+async def reply_schedule_with_links(update, season_start=None):
+    data = await asyncio.to_thread(get_schedule_with_links, season_start)
+    for part in split_message(data):  # строки самодостаточны, так что теги не рвутся
+        await update.message.reply_text(part, parse_mode="HTML", disable_web_page_preview=True)
+
+# === Страницы турниров (/tournament) ===
+# Статья турнира берётся по ссылке из календаря (или по имени "<год> <турнир>").
+# Из неё разбираются матчи: строки вида "игрок | счёт | игрок" и сетка плей-офф,
+# где у каждого игрока своя ячейка со счётом, а пары стоят друг под другом в одном столбце.
+# Разбор кэшируется по номеру ревизии статьи: пока ревизия та же, страница не разбирается.
+TOURNAMENT_FETCH_CONCURRENCY = 4
+TOURNAMENT_MATCHES_SHOWN = 40
+SCORE_RE = re.compile(r'^\d{1,2}$')
+SESSION_RE = re.compile(r'\b\d{1,2} (?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*(?:,? \d{1,2}:\d{2})?|\b\d{1,2}:\d{2}\b')
+REVISION_RE = re.compile(r'"wgRevisionId":\s*(\d+)')
+
+_tournament_pages = {}  # url -> (ревизия, разобранная страница)
+_tournament_prefetch = {'day': None}
+
+def tournament_article_url(t):
+    if t.get('article_url'):
+        return t['article_url']
+    return f"{WIKI_BASE_URL}/wiki/" + quote(f"{t['start'].year} {t['tournament']}".replace(' ', '_'))
+
+def article_revision(html):
+    """Номер ревизии из конфигурации MediaWiki на странице, иначе хэш содержимого."""
+    m = REVISION_RE.search(html)
+    return m.group(1) if m else hashlib.sha1(html.encode('utf-8')).hexdigest()
+
+def table_grid(table):
+    """Ячейки таблицы с координатами с учётом rowspan/colspan: {(строка, столбец): ячейка}."""
+    taken = set()
+    grid = {}
+    for r, row in enumerate(table.find_all('tr')):
+        c = 0
+        for cell in row.find_all(['td', 'th'], recursive=False):
+            while (r, c) in taken:
+                c += 1
+            rowspan, colspan = parse_int(cell.get('rowspan', '1')) or 1, parse_int(cell.get('colspan', '1')) or 1
+            taken.update((r + dr, c + dc) for dr in range(rowspan) for dc in range(colspan))
+            grid[(r, c)] = cell
+            c += colspan
+    return grid
+
+def is_player_cell(cell):
+    return bool(cell.find('span', class_='flagicon') or cell.find('a', href=re.compile(r'^/wiki/'))) \
+        and not SCORE_RE.match(cell.get_text(strip=True))
+
+def make_match(round_name, player1, score1, player2, score2, session=''):
+    s1, s2 = int(score1), int(score2)
+    return {
+        'round': round_name,
+        'player1': player1, 'score1': s1,
+        'player2': player2, 'score2': s2,
+        'winner': player1 if s1 > s2 else player2 if s2 > s1 else None,
+        'session': session,
+    }
+
+def row_session(cells):
+    """Дата или время сессии из ячеек строки, если они есть."""
+    return next((m.group(0) for m in (SESSION_RE.search(c.get_text(" ", strip=True)) for c in cells) if m), '')
+
+def extract_matches(table, section):
+    """Матчи из таблицы, где у каждого игрока своя ячейка счёта: "игрок | 6 | 3 | игрок" или сетка."""
+    grid = table_grid(table)
+    columns = {}  # столбец сетки -> [(строка, игрок, счёт)]
+    rounds = {}   # столбец -> название раунда из заголовка сетки
+    used = set()
+    matches = []
+    for (r, c), cell in sorted(grid.items()):
+        text = cell.get_text(" ", strip=True)
+        if cell.name == 'th' and text:
+            rounds.setdefault(c, text)
+        if (r, c) in used or not is_player_cell(cell):
+            continue
+        width = parse_int(cell.get('colspan', '1')) or 1
+        score = grid.get((r, c + width))
+        if score is None or not SCORE_RE.match(score.get_text(strip=True)):
+            continue
+        other_score, other = grid.get((r, c + width + 1)), grid.get((r, c + width + 2))
+        if other_score is not None and other is not None and SCORE_RE.match(other_score.get_text(strip=True)) \
+                and is_player_cell(other):
+            used.add((r, c + width + 2))
+            row_cells = [x for (rr, _), x in grid.items() if rr == r]
+            matches.append(make_match(section, text, score.get_text(strip=True), other.get_text(" ", strip=True),
+                                      other_score.get_text(strip=True), row_session(row_cells)))
+            continue
+        columns.setdefault(c, []).append((r, text, score.get_text(strip=True)))
+    for c, entries in sorted(columns.items()):
+        for (_, p1, s1), (_, p2, s2) in zip(entries[::2], entries[1::2]):
+            matches.append(make_match(rounds.get(c) or section, p1, s1, p2, s2))
+    return matches
+
+def extract_result_rows(table, section):
+    """Матчи из строк вида "игрок | 6–3 | игрок"."""
+    matches = []
+    for row in table.find_all('tr'):
+        cells = row.find_all(['td', 'th'], recursive=False)
+        for i in range(1, len(cells) - 1):
+            m = re.match(r'^(\d{1,2})\s*[–-]\s*(\d{1,2})$', cells[i].get_text(strip=True))
+            if m and is_player_cell(cells[i - 1]) and is_player_cell(cells[i + 1]):
+                matches.append(make_match(section, cells[i - 1].get_text(" ", strip=True), m.group(1),
+                                          cells[i + 1].get_text(" ", strip=True), m.group(2), row_session(cells)))
+    return matches
+
+def parse_tournament_page(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    matches = []
+    for table in soup.find_all('table'):
+        if table.find('table'):
+            continue  # берём только внутренние таблицы, иначе строки посчитаются дважды
+        heading = table.find_previous(['h2', 'h3', 'h4'])
+        section = heading.get_text(strip=True) if heading else ''
+        matches.extend(extract_result_rows(table, section) or extract_matches(table, section))
+    return {'revision': article_revision(html), 'matches': matches}
+
+def get_tournament_page(t):
+    """Разобранная статья турнира; при той же ревизии — из кэша без разбора."""
+    url = tournament_article_url(t)
+    html = fetch_html(url)
+    revision = article_revision(html)
+    cached = _tournament_pages.get(url)
+    if cached and cached[0] == revision:
+        record_cache('tournament_page', True)
+        return cached[1]
+    record_cache('tournament_page', False)
+    t0 = time.perf_counter()
+    page = parse_tournament_page(html)
+    observe('snooker_parse_duration_seconds', time.perf_counter() - t0, page='tournament')
+    _tournament_pages[url] = (revision, page)
+    return page
+
+async def fetch_tournament_pages(tournaments):
+    """Загружает статьи турниров не более чем по TOURNAMENT_FETCH_CONCURRENCY одновременно."""
+    semaphore = asyncio.Semaphore(TOURNAMENT_FETCH_CONCURRENCY)
+
+    async def fetch_one(t):
+        async with semaphore:
+            try:
+                return t, await asyncio.to_thread(get_tournament_page, t)
+            except Exception as e:
+                logging.warning(f"Не удалось загрузить статью {t['tournament']}: {e}")
+                return t, None
+
+    return await asyncio.gather(*(fetch_one(t) for t in tournaments))
+
+async def prefetch_tournament_pages(today):
+    """Прогревает кэш статей завтрашних и идущих турниров."""
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
+    tomorrow = today + timedelta(days=1)
+    wanted = [t for t in tournaments if t['start'] == tomorrow or t['start'] <= today <= (t['finish'] or t['start'])]
+    if wanted:
+        await fetch_tournament_pages(wanted)
+        logging.info(f"Подгружены статьи турниров: {', '.join(t['tournament'] for t in wanted)}")
+
+def render_tournament_page(t, page):
+    lines = [f"🏆 {t['tournament']}", f"📅 {t['start_str']} — {t['finish_str']}"]
+    if not page['matches']:
+        lines.append("\nМатчей в статье пока нет.")
+        return "\n".join(lines)
+    current_round = None
+    for m in page['matches'][-TOURNAMENT_MATCHES_SHOWN:]:
+        if m['round'] != current_round:
+            current_round = m['round']
+            lines += ["", f"— {current_round} —"] if current_round else [""]
+        mark1 = "✅ " if m['winner'] == m['player1'] else ""
+        mark2 = " ✅" if m['winner'] == m['player2'] else ""
+        session = f" ({m['session']})" if m['session'] else ""
+        lines.append(f"{mark1}{m['player1']} {m['score1']}–{m['score2']} {m['player2']}{mark2}{session}")
+    return "\n".join(lines)
+
+@track_command("tournament")
+@throttled("tournament", key=lambda context: tournament_id(" ".join(context.args)))
+async def tournament_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
+    query = " ".join(context.args)
+    if query:
+        name, options = resolve_player(query, [t['tournament'] for t in tournaments])
+    else:
+        name, options = await asyncio.to_thread(next_tournament), []
+    if not name:
+        await update.message.reply_text(
+            "Уточни турнир:\n" + "\n".join(options) if options else "Укажи турнир, например: /tournament UK Championship"
+        )
+        return
+    t = next(t for t in tournaments if t['tournament'] == name)
+    [(_, page)] = await fetch_tournament_pages([t])
+    if page is None:
+        await update.message.reply_text("Не удалось загрузить статью турнира 😕")
+        return
+    text = render_tournament_page(t, page)
+    remember_reply("tournament", text, key=tournament_id(query))
+    for part in split_message(text):
+        await update.message.reply_text(part)
+
+# === Live-режим: результаты идущих турниров (/live) ===
+# Пока турнир идёт (start <= сегодня <= finish), его статья опрашивается с адаптивным
+# интервалом: LIVE_FAST_INTERVAL в часы игры, дальше интервал растёт без изменений
+# до LIVE_SLOW_INTERVAL, ночью сразу медленный; после финиша опрос прекращается.
+# Запросы условные (ETag / Last-Modified), а тело с тем же хэшем не разбирается.
+LIVE_FAST_INTERVAL = 120
+LIVE_SLOW_INTERVAL = 1800
+LIVE_BACKOFF = 1.5
+LIVE_IDLE_INTERVAL = 6 * 3600  # проверка, не начался ли турнир, когда идущих нет
+LIVE_SESSION_HOURS = (10, 23)  # часы игры по времени площадки (REMINDER_SESSION_TZ)
+
+_live_pages = {}  # url -> {'etag', 'modified', 'hash', 'matches', 'interval', 'due'}
+
+def fetch_conditional(url):
+    """HTML страницы или None, если сервер ответил 304 либо хэш тела не изменился."""
+    state = _live_pages.setdefault(url, {})
+    headers = {}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('modified'):
+        headers['If-Modified-Since'] = state['modified']
+    response = http_get(url, headers=headers)
+    if response.status_code == 304:
+        record_cache('live_page', True)
+        return None
+    response.raise_for_status()
+    state['etag'] = response.headers.get('ETag')
+    state['modified'] = response.headers.get('Last-Modified')
+    digest = hashlib.sha1(response.content).hexdigest()
+    if digest == state.get('hash'):
+        record_cache('live_page', True)
+        return None
+    record_cache('live_page', False)
+    state['hash'] = digest
+    return response.text
+
+def match_key(m):
+    return m['round'], frozenset((normalize_name(m['player1']), normalize_name(m['player2'])))
+
+def new_results(previous, matches):
+    """Матчи с победителем, которых не было в previous или у которых сменился счёт."""
+    before = {match_key(m): (m['score1'], m['score2']) for m in previous}
+    return [m for m in matches if m['winner'] and before.get(match_key(m)) != (m['score1'], m['score2'])]
+
+def describe_result(t, m):
+    loser = m['player2'] if m['winner'] == m['player1'] else m['player1']
+    high, low = max(m['score1'], m['score2']), min(m['score1'], m['score2'])
+    round_name = f" ({m['round']})" if m['round'] else ""
+    return f"🎱 {t['tournament']}{round_name}: {m['winner']} выигрывает у {loser} {high}–{low}"
+
+def in_session(now=None):
+    hour = (now or datetime.now(REMINDER_SESSION_TZ)).astimezone(REMINDER_SESSION_TZ).hour
+    return LIVE_SESSION_HOURS[0] <= hour < LIVE_SESSION_HOURS[1]
+
+def next_live_interval(state, changed):
+    if not in_session():
+        return LIVE_SLOW_INTERVAL
+    if changed or 'interval' not in state:
+        return LIVE_FAST_INTERVAL
+    return min(LIVE_SLOW_INTERVAL, state['interval'] * LIVE_BACKOFF)
+
+def live_tournaments(today=None):
+    today = today or datetime.now(LOCAL_TZ).date()
+    return [t for t in _season_snapshots.get(current_season(), [])
+            if t['start'] <= today <= (t['finish'] or t['start'])]
+
+def fetch_live_matches(url):
+    """Матчи изменившейся страницы турнира или None, если она не менялась; загрузка и разбор — в потоке."""
+    html = fetch_conditional(url)
+    return parse_tournament_page(html)['matches'] if html is not None else None
+
+async def poll_live_tournament(bot, t):
+    url = tournament_article_url(t)
+    matches = await asyncio.to_thread(fetch_live_matches, url)
+    state = _live_pages[url]
+    results = []
+    if matches is not None:
+        if 'matches' in state:  # на первом опросе только запоминаем уже сыгранное
+            results = new_results(state['matches'], matches)
+        state['matches'] = matches
+    state['interval'] = next_live_interval(state, bool(results))
+    state['due'] = time.time() + state['interval']
+    if results:
+        chat_ids = {chat_id for chat_id, pref in load_user_prefs().items() if pref.get('live')}
+        for m in results:
+            await send_broadcast(bot, chat_ids, describe_result(t, m))
+
+async def live_loop(application):
+    """Опрашивает идущие турниры, каждый по своему расписанию, и спит до ближайшего."""
+    while True:
+        delay = LIVE_IDLE_INTERVAL
+        try:
+            active = live_tournaments()
+            urls = {tournament_article_url(t) for t in active}
+            for url in list(_live_pages):
+                if url not in urls:
+                    del _live_pages[url]  # турнир закончился — опрос прекращён
+            for t in active:
+                if _live_pages.get(tournament_article_url(t), {}).get('due', 0) <= time.time():
+                    try:
+                        await poll_live_tournament(application.bot, t)
+                    except Exception as e:
+                        logging.warning(f"Не удалось опросить {t['tournament']}: {e}")
+                        _live_pages.setdefault(tournament_article_url(t), {})['due'] = time.time() + LIVE_FAST_INTERVAL
+            if active:
+                delay = max(1, min(_live_pages[tournament_article_url(t)]['due'] for t in active) - time.time())
+        except Exception as e:
+            logging.error(f"Ошибка в live_loop: {e}")
+        await asyncio.sleep(delay)
+
+@track_command("live")
+async def live_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    with shared_file_lock(USER_PREFS_FILE):
+        pref = load_user_prefs().setdefault(chat_id, {})
+        pref['live'] = not pref.get('live')
+        save_user_prefs()
+    if not pref['live']:
+        await update.message.reply_text("✅ Результаты матчей больше не присылаю.")
+        return
+    active = live_tournaments()
+    now = f"\nСейчас идёт: {', '.join(t['tournament'] for t in active)}" if active else ""
+    await update.message.reply_text("✅ Буду присылать результаты матчей идущих турниров." + now)
+
+# === Объявления об изменениях календаря ===
+SCHEDULE_CHECK_INTERVAL = 1800
+
+def describe_schedule_change(kind, t, old):
+    if kind == 'winner':
+        return f"🏆 {t['tournament']}: победитель — {t['winner']}\n🥈 Финалист: {t['runner_up']}\n⚔️ Счёт финала: {t['score']}"
+    if kind == 'score':
+        return f"✏️ {t['tournament']}: счёт финала исправлен, {old['score']} → {t['score']}"
+    if kind == 'dates':
+        return (f"📅 {t['tournament']}: даты изменились — "
+                f"{old['start_str']} — {old['finish_str']} → {t['start_str']} — {t['finish_str']}")
+    return f"📍 {t['tournament']}: место проведения теперь {t['venue']} (было {old['venue']})"
+
+async def announce_schedule_changes(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(get_schedule_tournaments)
+        while _schedule_changes:
+            subscribers = load_subscribers()
+            subs = load_tournament_subs()
+            for kind, t, old in _schedule_changes.popleft():
+                chat_ids = subscribers | subs.get(tournament_id(t['tournament']), set())
+                if chat_ids:
+                    await send_broadcast(context.bot, chat_ids, describe_schedule_change(kind, t, old))
+    except Exception as e:
+        logging.error(f"Ошибка в announce_schedule_changes: {e}")
+
 # === Остальной код без изменений ===
 
 def get_tournaments():
     try:
-        url = "https://en.wikipedia.org/wiki/2025%E2%80%9326_snooker_season"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = BeautifulSoup(fetch_html(season_url(current_season())), 'html.parser')
         tables = soup.find_all('table', {'class': 'wikitable'})
         target_table = None
         for table in tables:
@@ -234,18 +1618,18 @@ def get_tournaments():
         logging.error(f"Ошибка парсинга турниров: {e}")
         return []
 
-def get_upcoming_tournament_tomorrow():
+def get_upcoming_tournament_tomorrow(today=None, tournaments=None):
     try:
-        tournaments = get_schedule_tournaments()
+        tournaments = get_schedule_tournaments() if tournaments is None else tournaments
         if not tournaments:
             return None
 
-        tomorrow = datetime.now(LOCAL_TZ).date() + timedelta(days=1)
+        today = today or datetime.now(LOCAL_TZ).date()
+        tomorrow = today + timedelta(days=1)
         for t in tournaments:
             if t['start'] == tomorrow:
                 return f"🎱 Завтра стартует чемпионат:\n🏆 {t['tournament']}\n📅 {t['start'].strftime('%d %B %Y')}"
 
-        today = datetime.now(LOCAL_TZ).date()
         future = [t for t in tournaments if t['start'] > today]
         if future:
             next_t = future[0]
@@ -257,100 +1641,391 @@ def get_upcoming_tournament_tomorrow():
         logging.error(f"Ошибка в get_upcoming_tournament_tomorrow: {e}")
         return None
 
-def get_world_ranking():
-    try:
-        url = "https://en.wikipedia.org/wiki/Snooker_world_rankings"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        tables = soup.find_all('table', {'class': 'wikitable'})
-        ranking_table = None
-        for table in tables:
-            headers = [th.text.strip() for th in table.find_all('th')]
-            if 'Points' in headers and 'Player' in headers:
-                ranking_table = table
-                break
+def find_ranking_table(soup):
+    """Ищет таблицу мирового рейтинга (колонки Player и Points)."""
+    tables = soup.find_all('table', {'class': 'wikitable'})
+    for table in tables:
+        headers = [th.text.strip() for th in table.find_all('th')]
+        if 'Points' in headers and 'Player' in headers:
+            return table
+    return None
 
-        if not ranking_table:
-            return "Не удалось найти таблицу рейтинга."
+def extract_ranking_rows(ranking_table):
+    rows = ranking_table.find_all('tr')[1:]
+    players = []
+    for row in rows:
+        cols = row.find_all(['td', 'th'])
+        if len(cols) >= 3:
+            players.append({
+                'position': cols[0].text.strip(),
+                'player': cols[1].text.strip(),
+                'points': cols[2].text.strip(),
+                'position_value': parse_int(cols[0].text),
+                'points_value': parse_int(cols[2].text),
+                'flag': cell_flag(cols[1]),
+            })
+    return players
 
-        rows = ranking_table.find_all('tr')[1:]
-        results = []
-        for row in rows:
-            cols = row.find_all(['td', 'th'])
-            if len(cols) >= 3:
-                position = cols[0].text.strip()
-                player = cols[1].text.strip()
-                points = cols[2].text.strip()
-                results.append(f"{position}. {player} — {points} очков")
+def parse_int(text):
+    """'1,234,500' или '12=' -> число; 0, если цифр нет."""
+    digits = re.sub(r'\D', '', text or '')
+    return int(digits) if digits else 0
 
-        if not results:
-            return "Рейтинг пуст."
+def render_ranking(players):
+    results = [f"{p['position']}. {p['flag'] + ' ' if p.get('flag') else ''}{p['player']} — {p['points']} очков"
+               for p in players]
+    return "🏆 Мировой рейтинг снукера:\n\n" + "\n".join(results)
 
-        return "🏆 Мировой рейтинг снукера:\n\n" + "\n".join(results)
-    except Exception as e:
-        return f"Ошибка при получении рейтинга: {e}"
+def ranking_from_html(html):
+    ranking_table = find_ranking_table(BeautifulSoup(html, 'html.parser'))
+    return extract_ranking_rows(ranking_table) if ranking_table else []
 
-async def send_commands_menu(update: Update):
-    keyboard = [
-        ["/start", "/unsubscribe"],
-        ["/current_season_schedule", "/players_ranking"],
-        ["/upcoming_tournament"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
-    await update.message.reply_text("📋 команды:", reply_markup=reply_markup)
+# === Источники данных: провайдеры и выбор самого быстрого ===
+# Провайдер — словарь {'schedule': f(season_start) -> [турнир], 'ranking': f() -> [игрок]}.
+# Записи у всех одинаковые: турнир — как в extract_schedule_rows, игрок — как в
+# extract_ranking_rows. resolve_records опрашивает PROVIDER_FANOUT первых провайдеров
+# параллельно и берёт первый годный ответ; следующие идут в ход, только если эти не справились.
+# Порядок — по доле ошибок и медиане задержки из _provider_stats, при равенстве — DATA_PROVIDERS.
+# По умолчанию провайдеры опрашиваются по одному: параллельный wikipedia_html качал бы всю
+# статью на каждом обновлении и съедал бы экономию раздела через mediawiki_api.
+# На весь опрос — RESOLVE_DEADLINE секунд (fetch_budget): когда срок вышел, оставшиеся провайдеры
+# не запрашиваются, а вызывающий отдаёт последний удачный снимок.
+DATA_PROVIDERS = os.getenv("DATA_PROVIDERS", "mediawiki_api,wikipedia_html,results_api").split(",")
+PROVIDER_FANOUT = int(os.getenv("PROVIDER_FANOUT", "1"))
+RESOLVE_DEADLINE = float(os.getenv("RESOLVE_DEADLINE", "20"))
+RESULTS_API_URL = os.getenv("RESULTS_API_URL")  # структурированный API результатов, если есть
+TOURNAMENT_FIELDS = ('start', 'finish', 'tournament', 'venue', 'winner', 'runner_up', 'score',
+                     'winner_name', 'runner_up_name', 'start_str', 'finish_str')
+PLAYER_FIELDS = ('position', 'player', 'points', 'position_value', 'points_value')
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_chat.id)
-    subscribers = load_subscribers()
-    message_text = ("⏰ Уведомления о турнирах будут приходить за день до начала, в 21:00 по GMT+3 (московскому времени)\n\n")
-    if user_id not in subscribers:
-        subscribers.add(user_id)
-        save_subscribers(subscribers)
-        await update.message.reply_text("✅ Ты подписан на уведомления о снукере.\n\n" + message_text)
-    else:
-        await update.message.reply_text("✅ Ты уже подписан.\n\n" + message_text)
-    await send_commands_menu(update)
+_provider_stats = {}  # (провайдер, вид) -> {'ok', 'errors', 'latencies'}
+_provider_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='provider')
+_parsed_pages = {}    # (провайдер, url) -> (хэш HTML, записи)
 
-async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_chat.id)
-    subscribers = load_subscribers()
-    if user_id in subscribers:
-        subscribers.remove(user_id)
-        save_subscribers(subscribers)
+def parse_page_cached(provider, url, html, parse):
+    """Записи из html; тот же HTML (по хэшу) повторно не разбирается."""
+    digest = hashlib.sha1(html.encode('utf-8')).hexdigest()
+    cached = _parsed_pages.get((provider, url))
+    if cached and cached[0] == digest:
+        record_cache('parse', True)
+        return cached[1]
+    record_cache('parse', False)
+    t0 = time.perf_counter()
+    records = parse(html)
+    observe('snooker_parse_duration_seconds', time.perf_counter() - t0, page=page_label(url))
+    _parsed_pages[(provider, url)] = (digest, records)
+    return records
+
+def html_schedule(season_start):
+    url = season_url(season_start)
+    parse = functools.partial(schedule_from_html, season_start=season_start)
+    html = fetch_html(url)
+    records = parse_page_cached('wikipedia_html', url, html, parse)
+    return remember_schedule_source(season_start, 'wikipedia_html', records, html)
+
+def html_ranking():
+    return parse_page_cached('wikipedia_html', RANKING_URL, fetch_html(RANKING_URL), ranking_from_html)
+
+def api_schedule(season_start):
+    url = season_url(season_start)
+    parse = functools.partial(schedule_from_html, season_start=season_start)
+    html = fetch_table_html(url, CALENDAR_SECTION_HINTS)
+    records = parse_page_cached('mediawiki_api', url, html, parse)
+    if not records:
+        forget_section(url)
+    return remember_schedule_source(season_start, 'mediawiki_api', records, html)
+
+def api_ranking():
+    html = fetch_table_html(RANKING_URL, RANKING_SECTION_HINTS)
+    records = parse_page_cached('mediawiki_api', RANKING_URL, html, ranking_from_html)
+    if not records:
+        forget_section(RANKING_URL)
+    return records
+
+def results_api_get(path):
+    response = http_get(RESULTS_API_URL.rstrip('/') + path)
+    response.raise_for_status()
+    return response.json()
+
+def short_date(d):
+    return f"{d.day} {d.strftime('%b')}" if d else ''
+
+def tournament_record(item):
+    """Турнир из JSON API результатов: {name, start, finish, venue, winner, winner_country, ...}."""
+    start = datetime.fromisoformat(item['start']).date()
+    finish = datetime.fromisoformat(item['finish']).date() if item.get('finish') else None
+    names = {role: item.get(role) or '' for role in ('winner', 'runner_up')}
+    flags = {role: FLAG_EMOJI.get((item.get(f'{role}_country') or '').upper(), '') for role in names}
+    return {
+        'fingerprint': hashlib.sha1(json.dumps(item, sort_keys=True).encode('utf-8')).hexdigest(),
+        'start': start,
+        'finish': finish,
+        'tournament': item['name'],
+        'venue': item.get('venue') or '',
+        'winner': f"{flags['winner']} {names['winner']}".strip(),
+        'runner_up': f"{flags['runner_up']} {names['runner_up']}".strip(),
+        'winner_name': names['winner'],
+        'runner_up_name': names['runner_up'],
+        'winner_flag': flags['winner'],
+        'runner_up_flag': flags['runner_up'],
+        'ref_ids': [],
+        'article_url': item.get('url'),
+        'score': item.get('score') or '',
+        'start_str': short_date(start),
+        'finish_str': short_date(finish),
+    }
+
+def player_record(item):
+    """Игрок из JSON API результатов: {position, player, points, country}."""
+    return {
+        'position': str(item['position']),
+        'player': item['player'],
+        'points': f"{item['points']:,}",
+        'position_value': int(item['position']),
+        'points_value': int(item['points']),
+        'flag': FLAG_EMOJI.get((item.get('country') or '').upper(), ''),
+    }
+
+def results_api_schedule(season_start):
+    tournaments = [tournament_record(item) for item in results_api_get(f"/seasons/{season_start}/tournaments")]
+    return sorted(tournaments, key=lambda x: x['start'])
+
+def results_api_ranking():
+    return [player_record(item) for item in results_api_get("/rankings")]
+
+PROVIDERS = {
+    'mediawiki_api': {'schedule': api_schedule, 'ranking': api_ranking},
+    'wikipedia_html': {'schedule': html_schedule, 'ranking': html_ranking},
+    'results_api': {'schedule': results_api_schedule, 'ranking': results_api_ranking},
+}
+
+def valid_records(kind, records):
+    fields = TOURNAMENT_FIELDS if kind == 'schedule' else PLAYER_FIELDS
+    return bool(records) and all(all(f in r for f in fields) for r in records)
+
+def provider_stats(name, kind):
+    return _provider_stats.setdefault((name, kind), {'ok': 0, 'errors': 0, 'latencies': deque(maxlen=50)})
+
+def provider_order(kind):
+    """Включённые провайдеры: сначала с меньшей долей ошибок, затем с меньшей медианой задержки.
+
+    Ещё не отвечавшие идут после измеренных: запасной провайдер не должен обгонять
+    основной только потому, что его задержку ни разу не мерили.
+    """
+    names = [n for n in DATA_PROVIDERS if n in PROVIDERS and (n != 'results_api' or RESULTS_API_URL)]
+
+    def rank(name):
+        stats = provider_stats(name, kind)
+        total = stats['ok'] + stats['errors']
+        error_rate = stats['errors'] / total if total else 0
+        latency = sorted(stats['latencies'])[len(stats['latencies']) // 2] if stats['latencies'] else float('inf')
+        return round(error_rate, 1), latency
+
+    return sorted(names, key=rank)
+
+def call_provider(name, kind, args, deadline=None):
+    stats = provider_stats(name, kind)
+    t0 = time.perf_counter()
+    _fetch_budget.deadline = deadline  # поток пула: срок resolve_records действует и здесь
+    try:
+        records = PROVIDERS[name][kind](*args)
+    except FetchBudgetExceeded:
+        raise  # провайдера даже не спросили — это не его ошибка
+    except Exception:
+        stats['errors'] += 1
+        inc_counter('snooker_provider_errors_total', provider=name, kind=kind)
+        raise
+    finally:
+        _fetch_budget.deadline = None
+        observe('snooker_provider_duration_seconds', time.perf_counter() - t0, provider=name, kind=kind)
+    if valid_records(kind, records):
+        stats['ok'] += 1
+        stats['latencies'].append(time.perf_counter() - t0)
+    else:
+        stats['errors'] += 1
+    return records
+
+def resolve_records(kind, *args):
+    """Первый годный ответ провайдеров; [] — если все ответили без данных. Ошибку пробрасываем,
+    только если ни один провайдер не ответил вовсе; FetchBudgetExceeded — если не успели за срок."""
+    error = None
+    answered = False
+    order = provider_order(kind)
+    with fetch_budget(RESOLVE_DEADLINE) as deadline:
+        for i in range(0, len(order), PROVIDER_FANOUT):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                error = FetchBudgetExceeded(f"{kind}: за {RESOLVE_DEADLINE:g} с никто не ответил")
+                break
+            batch = order[i:i + PROVIDER_FANOUT]
+            futures = [_provider_pool.submit(call_provider, name, kind, args, deadline) for name in batch]
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout=remaining):
+                    try:
+                        records = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    answered = True
+                    if valid_records(kind, records):
+                        return records
+            except concurrent.futures.TimeoutError:  # опоздавшие досчитают в фоне, их ответ не ждём
+                error = FetchBudgetExceeded(f"{kind}: за {RESOLVE_DEADLINE:g} с никто не ответил")
+                break
+    if error is not None and not answered:
+        raise error
+    return []
+
+_ranking_parsed = {'players': None}  # последний рейтинг, для которого записана история
+
+def get_ranking_players():
+    """Строки рейтинга или None, если таблицы нет ни у одного провайдера. Ошибки загрузки пробрасываются;
+    не уложились в RESOLVE_DEADLINE — отдаём последний разобранный рейтинг, если он есть.
+
+    Тот же рейтинг, что и в прошлый раз, не сравнивается со снимком заново. Историю пишет и изменения
+    для рассылки копит только лидер: иначе их забрала бы реплика, которая ничего не рассылает.
+    """
+    try:
+        players = resolve_records('ranking')
+    except FetchBudgetExceeded as e:
+        if _ranking_parsed['players'] is None:
+            raise
+        logging.warning(f"Отдаю последний рейтинг: {e}")
+        return _ranking_parsed['players']
+    if not players:
+        return None
+    if players == _ranking_parsed['players']:
+        return _ranking_parsed['players']
+    if is_leader():
+        try:
+            previous = last_ranking_snapshot()
+            if record_ranking_snapshot(players) and previous:
+                changes = diff_rankings(previous, players)
+                if changes:
+                    _ranking_changes.append(changes)
+        except Exception as e:
+            logging.error(f"Не удалось записать снимок рейтинга: {e}")
+    _ranking_parsed['players'] = players
+    return players
+
+def get_world_ranking():
+    try:
+        players = get_ranking_players()
+        if players is None:
+            return "Не удалось найти таблицу рейтинга."
+        if not players:
+            return "Рейтинг пуст."
+
+        return render_ranking(players)
+    except Exception as e:
+        return f"Ошибка при получении рейтинга: {e}"
+
+def split_message(data, max_len=4000):
+    """Режет длинный текст по строкам на куски не длиннее max_len (лимит Telegram — 4096)."""
+    if len(data) <= max_len:
+        return [data]
+    parts = []
+    current = ""
+    for line in data.split("\n"):
+        if len(current) + len(line) + 1 > max_len:
+            parts.append(current)
+            current = ""
+        current += line + "\n"
+    if current:
+        parts.append(current)
+    return parts
+
+async def send_commands_menu(update: Update):
+    keyboard = [
+        ["/start", "/unsubscribe"],
+        ["/current_season_schedule", "/players_ranking"],
+        ["/upcoming_tournament", "/tournaments"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    await update.message.reply_text("📋 команды:", reply_markup=reply_markup)
+
+@track_command("start")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_chat.id)
+    message_text = (
+        f"⏰ Уведомления о турнирах будут приходить за день до начала, {describe_delivery(user_id)}\n"
+        "Поменять: /timezone и /hour\n\n"
+    )
+    if add_subscriber(user_id):
+        place_on_wheel(user_id)
+        await update.message.reply_text("✅ Ты подписан на уведомления о снукере.\n\n" + message_text)
+    else:
+        await update.message.reply_text("✅ Ты уже подписан.\n\n" + message_text)
+    await send_commands_menu(update)
+
+@track_command("unsubscribe")
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_chat.id)
+    if remove_subscriber(user_id):
         await update.message.reply_text("✅ Ты отписан от уведомлений о снукере.")
     else:
         await update.message.reply_text("⚠️ Ты не был подписан.")
     await send_commands_menu(update)
 
+@track_command("current_season_schedule")
+@throttled("current_season_schedule")
 async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("⏳ Получаю расписание чемпионатов текущего сезона...")
-    data = get_schedule()
+    if context.args and context.args[-1].lower() in LINKS_ARGS:
+        await reply_schedule_with_links(update)
+        await send_commands_menu(update)
+        return
+    data = await asyncio.to_thread(get_schedule)
+    if data.startswith("📅"):  # ошибки в кэш не кладём
+        remember_reply("current_season_schedule", data)
     if len(data) > 3900:
         data = data[:3900] + "\n\n...и ещё турниры доступны на Википедии."
     await update.message.reply_text(data)
     await send_commands_menu(update)
 
+@track_command("players_ranking")
+@throttled("players_ranking")
 async def ranking_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("⏳ Получаю текущий мировой рейтинг...")
-    data = get_world_ranking()
-    max_len = 4000
-    if len(data) <= max_len:
-        await update.message.reply_text(data)
-    else:
-        parts = []
-        current = ""
-        for line in data.split("\n"):
-            if len(current) + len(line) + 1 > max_len:
-                parts.append(current)
-                current = ""
-            current += line + "\n"
-        if current:
-            parts.append(current)
-        for part in parts:
-            await update.message.reply_text(part)
+    data = await asyncio.to_thread(get_world_ranking)
+    if data.startswith("🏆"):
+        remember_reply("players_ranking", data)
+    for part in split_message(data):
+        await update.message.reply_text(part)
     await update.message.reply_text("а сколько твой рейтинг?)")
     await send_commands_menu(update)
 
+def requested_season(context):
+    """Сезон из аргументов /season (без «ссылки»); None, если не разобрать."""
+    args = [a for a in context.args if a.lower() not in LINKS_ARGS]
+    return parse_season_label(" ".join(args)) if args else current_season()
+
+@track_command("season")
+@throttled("season", key=requested_season)
+async def season_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = [a for a in context.args if a.lower() not in LINKS_ARGS]
+    season_start = requested_season(context)
+    if season_start is None or season_start > current_season() + 1:
+        await update.message.reply_text("Укажи сезон, например: /season 2023-24 или /season 2023-24 ссылки")
+        return
+
+    await update.message.reply_text(f"⏳ Получаю расписание сезона {season_label(season_start)}...")
+    if len(args) != len(context.args):
+        await reply_schedule_with_links(update, season_start)
+        await send_commands_menu(update)
+        return
+    data = await asyncio.to_thread(get_schedule, season_start)
+    if not data.startswith("📅"):
+        await update.message.reply_text(f"Нет данных о сезоне {season_label(season_start)}.")
+        return
+    data = f"🗓 Сезон {season_label(season_start)}\n\n" + data
+    remember_reply("season", data, key=season_start)
+    if len(data) > 3900:
+        data = data[:3900] + "\n\n...и ещё турниры доступны на Википедии."
+    await update.message.reply_text(data)
+    await send_commands_menu(update)
+
+@track_command("message")
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_chat.id)
     user = update.effective_user
@@ -374,8 +2049,10 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("мы все учтем, спасибо!")
     await send_commands_menu(update)
 
+@track_command("upcoming_tournament")
+@throttled("upcoming_tournament")
 async def next_tournament_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    tournaments = get_schedule_tournaments()
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
     if not tournaments:
         await update.message.reply_text("Не удалось получить данные о турнирах.")
         return
@@ -394,39 +2071,1712 @@ async def next_tournament_command(update: Update, context: ContextTypes.DEFAULT_
         f"📅 Начинается: {next_t['start'].strftime('%d %B %Y')}\n"
         f"⏳ Осталось дней: {days_left}"
     )
+    remember_reply("upcoming_tournament", msg)
     await update.message.reply_text(msg)
     await send_commands_menu(update)
 
 async def daily_notification(context: ContextTypes.DEFAULT_TYPE):
+    """Тик колеса доставки (каждые 15 минут): рассылка чатам корзины этого тика.
+
+    При догоне пропущенных тиков планировщик передаёт время тика, так что
+    разослана будет именно пропущенная корзина, а не текущая.
+    """
     try:
-        text = get_upcoming_tournament_tomorrow()
-        if not text:
-            text = "Пока нет ближайших турниров."
+        at = datetime.fromtimestamp(_job_due.get('daily_notification', time.time()), pytz.utc)
+        today = datetime.now(LOCAL_TZ).date()
+        if _tournament_prefetch['day'] != today:  # раз в день вместе с рассылкой
+            _tournament_prefetch['day'] = today
+            context.application.create_task(prefetch_tournament_pages(today))
+
+        slot = current_slot(at)
+        bucket = set(_wheel[slot])
+        if not bucket:
+            return
+
+        # один снимок календаря на тик; PAGE_CACHE_TTL короче тика, так что загрузка почти всегда сетевая
+        tournaments = await asyncio.to_thread(get_schedule_tournaments)
 
         subscribers = load_subscribers()
-        for chat_id in subscribers:
-            try:
-                await context.bot.send_message(chat_id=chat_id, text=text)
-                logging.info(f"Отправлено уведомление {chat_id}")
-            except Exception as e:
-                logging.warning(f"Ошибка отправки {chat_id}: {e}")
+        by_date = {}  # у чатов одной корзины местная дата может отличаться
+        for chat_id in bucket:
+            by_date.setdefault(local_today(chat_id, at), set()).add(chat_id)
+
+        for today, chat_ids in by_date.items():
+            targets = chat_ids & subscribers
+            fresh = await asyncio.to_thread(claim_deliveries, f"daily:{today}", targets) if targets else set()
+            if fresh:
+                await send_broadcast(context.bot, fresh, daily_message(today, tournaments))
+            await notify_tournament_subscribers(context.bot, chat_ids, targets, today, tournaments)
     except Exception as e:
         logging.error(f"Ошибка в daily_notification: {e}")
 
+async def send_broadcast(bot, chat_ids, text):
+    """Рассылает text по chat_ids; ошибки отдельных чатов логируются и не прерывают рассылку."""
+    t0 = time.perf_counter()
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            inc_counter('snooker_broadcast_messages_total', result='ok')
+            logging.info(f"Отправлено уведомление {chat_id}")
+        except Exception as e:
+            inc_counter('snooker_broadcast_messages_total', result='error')
+            logging.warning(f"Ошибка отправки {chat_id}: {e}")
+    observe('snooker_broadcast_duration_seconds', time.perf_counter() - t0)
+
+# === Подписки на отдельные турниры (/tournaments) ===
+# tournament_id — нормализованное название («uk championship»), одно и то же из сезона в сезон.
+# Таблица подписок: tournament_id -> set(chat_id), так что напоминание о турнире
+# получает только его набор подписчиков, найденный одним обращением к словарю.
+_tournament_subs = None
+
+def tournament_id(name):
+    tid = normalize_name(name)
+    if len(tid.encode('utf-8')) > 58:  # callback_data у Telegram — не больше 64 байт
+        tid = hashlib.sha1(tid.encode('utf-8')).hexdigest()[:16]
+    return tid
+
+def load_tournament_subs():
+    global _tournament_subs
+    if _tournament_subs is None or shared_file_changed(TOURNAMENT_SUBS_FILE):
+        remember_version(TOURNAMENT_SUBS_FILE)
+        data = {}
+        if os.path.exists(TOURNAMENT_SUBS_FILE):
+            with open(TOURNAMENT_SUBS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        _tournament_subs = {tid: set(chats) for tid, chats in data.items()}
+    return _tournament_subs
+
+def save_tournament_subs():
+    write_json_atomic(TOURNAMENT_SUBS_FILE, {tid: sorted(chats) for tid, chats in _tournament_subs.items() if chats})
+
+async def notify_tournament_subscribers(bot, bucket, already_notified, today, tournaments):
+    """Напоминание о турнирах, стартующих завтра, — их подписчикам из корзины bucket (без получивших общую рассылку)."""
+    tomorrow = today + timedelta(days=1)
+    subs = load_tournament_subs()
+    for t in tournaments:
+        if t['start'] != tomorrow:
+            continue
+        tid = tournament_id(t['tournament'])
+        chat_ids = (subs.get(tid, set()) & bucket) - already_notified
+        if chat_ids:
+            chat_ids = await asyncio.to_thread(claim_deliveries, f"tournament:{tid}:{today}", chat_ids)
+        if chat_ids:
+            text = f"🎱 Завтра стартует турнир из твоих подписок:\n🏆 {t['tournament']}\n📍 {t['venue']}"
+            await send_broadcast(bot, chat_ids, text)
+
+def tournaments_keyboard(chat_id, tournaments):
+    subs = load_tournament_subs()
+    buttons = []
+    seen = set()
+    for t in tournaments:
+        tid = tournament_id(t['tournament'])
+        if tid in seen:
+            continue
+        seen.add(tid)
+        mark = "✅" if chat_id in subs.get(tid, set()) else "▫️"
+        buttons.append([InlineKeyboardButton(f"{mark} {t['tournament']}", callback_data=f"tsub:{tid}")])
+    return InlineKeyboardMarkup(buttons)
+
+@track_command("tournaments")
+async def tournaments_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
+    if not tournaments:
+        await update.message.reply_text("Не удалось получить данные о турнирах.")
+        return
+    chat_id = str(update.effective_chat.id)
+    await update.message.reply_text(
+        "Выбери турниры, о старте которых напомнить (нажми ещё раз, чтобы отписаться):",
+        reply_markup=tournaments_keyboard(chat_id, tournaments),
+    )
+
+async def tournament_toggle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    chat_id = str(query.message.chat.id)
+    tid = query.data.split(':', 1)[1]
+    with shared_file_lock(TOURNAMENT_SUBS_FILE):
+        chats = load_tournament_subs().setdefault(tid, set())
+        if chat_id in chats:
+            chats.discard(chat_id)
+            answer = "Подписка снята"
+        else:
+            chats.add(chat_id)
+            answer = "Напомню за день до старта"
+            place_on_wheel(chat_id)
+        save_tournament_subs()
+    await query.answer(answer)
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
+    if tournaments:
+        await query.edit_message_reply_markup(reply_markup=tournaments_keyboard(chat_id, tournaments))
+
+# === Доставка по часовым поясам: колесо на 96 корзин ===
+# Сутки по UTC делятся на 96 корзин по 15 минут. Каждый чат лежит в корзине, куда попадает
+# его «предпочтительный час» в его поясе. Один повторяющийся джоб раз в 15 минут берёт
+# текущую корзину и рассылает ей общее, один раз отрендеренное на дату сообщение —
+# вместо отдельного джоба на каждого пользователя и одного пика в 21:00.
+DEFAULT_DELIVERY_TZ = 'Europe/Moscow'
+DEFAULT_DELIVERY_HOUR = 21
+WHEEL_SLOT_MINUTES = 15
+WHEEL_SLOTS = 24 * 60 // WHEEL_SLOT_MINUTES
+
+TIMEZONE_ALIASES = {
+    'москва': 'Europe/Moscow', 'мск': 'Europe/Moscow', 'лондон': 'Europe/London',
+    'великобритания': 'Europe/London', 'uk': 'Europe/London', 'китай': 'Asia/Shanghai',
+    'пекин': 'Asia/Shanghai', 'шанхай': 'Asia/Shanghai', 'china': 'Asia/Shanghai',
+    'гонконг': 'Asia/Hong_Kong', 'таиланд': 'Asia/Bangkok', 'бангкок': 'Asia/Bangkok',
+}
+_TZ_BY_LOWER = {name.lower(): name for name in pytz.all_timezones}
+
+_user_prefs = None
+_wheel = [set() for _ in range(WHEEL_SLOTS)]
+_wheel_slot = {}     # chat_id -> номер корзины
+_daily_texts = {}    # местная дата -> отрендеренное сообщение
+
+def load_user_prefs():
+    """chat_id -> {'tz': имя пояса, 'hour': 0..23}"""
+    global _user_prefs
+    if _user_prefs is None or shared_file_changed(USER_PREFS_FILE):
+        remember_version(USER_PREFS_FILE)
+        _user_prefs = {}
+        if os.path.exists(USER_PREFS_FILE):
+            with open(USER_PREFS_FILE, 'r', encoding='utf-8') as f:
+                _user_prefs = json.load(f)
+    return _user_prefs
+
+def save_user_prefs():
+    write_json_atomic(USER_PREFS_FILE, _user_prefs, ensure_ascii=False)
+
+def parse_timezone(text):
+    """'Asia/Shanghai', 'лондон', 'UTC+8', '+5:30' -> имя пояса для хранения или None."""
+    text = (text or '').strip()
+    if text.lower() in TIMEZONE_ALIASES:
+        return TIMEZONE_ALIASES[text.lower()]
+    if text.lower() in _TZ_BY_LOWER:
+        return _TZ_BY_LOWER[text.lower()]
+    match = re.fullmatch(r'(?:utc|gmt)?\s*([+-])(\d{1,2})(?::?(\d{2}))?', text.lower())
+    if match:
+        sign, hours, minutes = match.group(1), int(match.group(2)), int(match.group(3) or 0)
+        if hours <= 14 and minutes < 60:
+            return f"UTC{sign}{hours:02d}:{minutes:02d}"
+    return None
+
+def get_tz(name):
+    if name.startswith('UTC') and len(name) > 3:
+        sign = 1 if name[3] == '+' else -1
+        hours, minutes = name[4:].split(':')
+        return pytz.FixedOffset(sign * (int(hours) * 60 + int(minutes)))
+    return pytz.timezone(name)
+
+def delivery_prefs(chat_id):
+    pref = load_user_prefs().get(str(chat_id), {})
+    return pref.get('tz', DEFAULT_DELIVERY_TZ), pref.get('hour', DEFAULT_DELIVERY_HOUR)
+
+def describe_delivery(chat_id):
+    tz_name, hour = delivery_prefs(chat_id)
+    return f"в {hour:02d}:00 по поясу {tz_name}"
+
+def local_today(chat_id, at=None):
+    """Местная дата чата сейчас или в момент at (datetime с поясом)."""
+    tz = get_tz(delivery_prefs(chat_id)[0])
+    return (at or datetime.now(pytz.utc)).astimezone(tz).date()
+
+def delivery_slot(chat_id):
+    """Корзина, в которую сегодня попадает местный час доставки чата (с учётом перехода на летнее время)."""
+    tz_name, hour = delivery_prefs(chat_id)
+    tz = get_tz(tz_name)
+    local = tz.localize(datetime.combine(datetime.now(tz).date(), dt_time(hour)))
+    utc = local.astimezone(pytz.utc)
+    return (utc.hour * 60 + utc.minute) // WHEEL_SLOT_MINUTES
+
+def current_slot(now=None):
+    now = (now or datetime.now(pytz.utc)).astimezone(pytz.utc)
+    return (now.hour * 60 + now.minute) // WHEEL_SLOT_MINUTES
+
+def place_on_wheel(chat_id):
+    chat_id = str(chat_id)
+    old = _wheel_slot.get(chat_id)
+    if old is not None:
+        _wheel[old].discard(chat_id)
+    slot = delivery_slot(chat_id)
+    _wheel[slot].add(chat_id)
+    _wheel_slot[chat_id] = slot
+
+def alert_chats():
+    """Все чаты, которым что-то шлётся ежедневно: общие подписчики и подписчики турниров."""
+    chats = set(load_subscribers())
+    for chat_ids in load_tournament_subs().values():
+        chats |= chat_ids
+    return chats
+
+async def rebuild_wheel(context: ContextTypes.DEFAULT_TYPE):
+    """Раз в сутки (и при старте): заново раскладывает чаты по корзинам и сбрасывает кэш текстов."""
+    for bucket in _wheel:
+        bucket.clear()
+    _wheel_slot.clear()
+    _daily_texts.clear()
+    for chat_id in alert_chats():
+        try:
+            place_on_wheel(chat_id)
+        except Exception as e:
+            logging.warning(f"Не удалось определить время доставки для {chat_id}: {e}")
+    logging.info(f"Колесо доставки: {len(_wheel_slot)} чатов в {sum(1 for b in _wheel if b)} корзинах")
+
+def daily_message(today, tournaments):
+    """Ежедневное сообщение для местной даты today по снимку tournaments; рендерится один раз на дату."""
+    if today not in _daily_texts:
+        _daily_texts[today] = get_upcoming_tournament_tomorrow(today, tournaments) or "Пока нет ближайших турниров."
+    return _daily_texts[today]
+
+@track_command("timezone")
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    if not context.args:
+        await update.message.reply_text(
+            f"Сейчас уведомления приходят {describe_delivery(chat_id)}.\n"
+            "Сменить пояс: /timezone Europe/London (или лондон, китай, UTC+8)"
+        )
+        return
+    tz_name = parse_timezone(" ".join(context.args))
+    if not tz_name:
+        await update.message.reply_text("Не знаю такой пояс. Примеры: Europe/London, Asia/Shanghai, UTC+3")
+        return
+    with shared_file_lock(USER_PREFS_FILE):
+        load_user_prefs().setdefault(chat_id, {})['tz'] = tz_name
+        save_user_prefs()
+    place_on_wheel(chat_id)
+    await update.message.reply_text(f"✅ Буду присылать уведомления {describe_delivery(chat_id)}.")
+
+@track_command("hour")
+async def hour_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    try:
+        hour = int(context.args[0])
+    except (IndexError, ValueError):
+        hour = -1
+    if not 0 <= hour <= 23:
+        await update.message.reply_text("Укажи час от 0 до 23, например: /hour 9")
+        return
+    with shared_file_lock(USER_PREFS_FILE):
+        load_user_prefs().setdefault(chat_id, {})['hour'] = hour
+        save_user_prefs()
+    place_on_wheel(chat_id)
+    await update.message.reply_text(f"✅ Буду присылать уведомления {describe_delivery(chat_id)}.")
+
+# === Напоминания с несколькими отступами (/reminders) ===
+# Из снимка календаря строятся события «турнир × отступ» и кладутся в кучу по времени.
+# Фоновая задача спит ровно до ближайшего события; когда снимок календаря меняется,
+# get_schedule_tournaments будит её, и в кучу добавляются только новые/перенесённые турниры.
+# Устаревшие события не выковыриваются из кучи, а отбрасываются при извлечении.
+# Сезон — это десятки турниров × 4 отступа, то есть пара сотен кортежей.
+REMINDER_OFFSETS = {
+    '7d': timedelta(days=7),
+    '1d': timedelta(days=1),
+    '1h': timedelta(hours=1),
+    'start': timedelta(0),
+}
+REMINDER_TEXT = {
+    '7d': "⏰ Через неделю стартует",
+    '1d': "⏰ Завтра стартует",
+    '1h': "⏰ Через час стартует",
+    'start': "🎱 Стартует",
+}
+# В календаре сезона только даты, поэтому начало первой сессии берём условно — 10:00 по Великобритании
+REMINDER_SESSION_TZ = pytz.timezone('Europe/London')
+REMINDER_SESSION_HOUR = 10
+
+_reminder_heap = []        # (время, seq, tournament_id, дата старта, отступ)
+_reminder_seq = itertools.count()
+_reminder_tournaments = {}  # (tournament_id, дата старта) -> турнир из текущего снимка
+_reminder_wakeup = None
+_reminder_loop = None
+
+def session_start(t):
+    return REMINDER_SESSION_TZ.localize(datetime.combine(t['start'], dt_time(REMINDER_SESSION_HOUR)))
+
+def apply_schedule_snapshot(tournaments):
+    """Обновляет кучу по новому снимку: события добавляются только для новых или перенесённых турниров."""
+    current = {(tournament_id(t['tournament']), t['start']): t for t in tournaments}
+    added = current.keys() - _reminder_tournaments.keys()
+    _reminder_tournaments.clear()
+    _reminder_tournaments.update(current)
+    now = time.time()
+    for key in added:
+        begins = session_start(current[key])
+        for offset, delta in REMINDER_OFFSETS.items():
+            due = (begins - delta).timestamp()
+            if due > now:
+                heapq.heappush(_reminder_heap, (due, next(_reminder_seq), key[0], key[1], offset))
+    if added and _reminder_wakeup:
+        _reminder_wakeup.set()
+
+def notify_schedule_snapshot(tournaments):
+    """Вызывается из любого потока после удачного разбора календаря."""
+    if _reminder_loop and not _reminder_loop.is_closed():
+        _reminder_loop.call_soon_threadsafe(apply_schedule_snapshot, tournaments)
+
+def reminder_offsets(pref, tid):
+    return pref.get('tournament_offsets', {}).get(tid) or pref.get('offsets') or []
+
+def reminder_recipients(tid, offset):
+    """Чаты, настроившие отступ offset для турнира tid (персонально или по умолчанию для своих турниров)."""
+    subscribers = load_subscribers()
+    tournament_chats = load_tournament_subs().get(tid, set())
+    recipients = set()
+    for chat_id, pref in load_user_prefs().items():
+        if offset not in reminder_offsets(pref, tid):
+            continue
+        if tid in pref.get('tournament_offsets', {}) or chat_id in subscribers or chat_id in tournament_chats:
+            recipients.add(chat_id)
+    return recipients
+
+async def fire_due_reminders(bot):
+    now = time.time()
+    while _reminder_heap and _reminder_heap[0][0] <= now:
+        _, _, tid, start, offset = heapq.heappop(_reminder_heap)
+        t = _reminder_tournaments.get((tid, start))
+        if t is None:  # турнир перенесли или убрали из календаря
+            continue
+        recipients = reminder_recipients(tid, offset)
+        if recipients:
+            text = f"{REMINDER_TEXT[offset]}:\n🏆 {t['tournament']}\n📍 {t['venue']}\n📅 {t['start_str']} — {t['finish_str']}"
+            await send_broadcast(bot, recipients, text)
+
+async def reminder_loop(application):
+    global _reminder_wakeup, _reminder_loop
+    _reminder_wakeup = asyncio.Event()
+    _reminder_loop = asyncio.get_running_loop()
+    tournaments = await asyncio.to_thread(get_schedule_tournaments)
+    apply_schedule_snapshot(tournaments)
+    while True:
+        try:
+            await fire_due_reminders(application.bot)
+        except Exception as e:
+            logging.error(f"Ошибка в reminder_loop: {e}")
+        delay = max(0, _reminder_heap[0][0] - time.time()) if _reminder_heap else None
+        _reminder_wakeup.clear()
+        try:
+            await asyncio.wait_for(_reminder_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+def describe_reminders(pref):
+    lines = [f"По умолчанию: {', '.join(pref.get('offsets', [])) or 'выключены'}"]
+    for tid, offsets in pref.get('tournament_offsets', {}).items():
+        lines.append(f"{tid}: {', '.join(offsets)}")
+    return "\n".join(lines)
+
+@track_command("reminders")
+async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    pref = load_user_prefs().setdefault(chat_id, {})
+    offsets = [a.lower() for a in context.args if a.lower() in REMINDER_OFFSETS]
+    name = " ".join(a for a in context.args if a.lower() not in REMINDER_OFFSETS and a.lower() != 'off')
+    if not context.args:
+        await update.message.reply_text(
+            "Напоминания о старте турниров: за 7d, 1d, 1h и в момент старта (start).\n"
+            "/reminders 7d 1d — для всех твоих турниров\n"
+            "/reminders 1h start UK Championship — для одного турнира\n"
+            "/reminders off — выключить\n\n" + describe_reminders(pref)
+        )
+        return
+
+    if name:
+        tournaments = await asyncio.to_thread(get_schedule_tournaments)
+        title, options = resolve_player(name, {t['tournament'] for t in tournaments})
+        if not title:
+            await update.message.reply_text(
+                "Уточни турнир:\n" + "\n".join(options) if options else "Не нашёл такой турнир в календаре."
+            )
+            return
+        tid = tournament_id(title)
+        if offsets:
+            pref.setdefault('tournament_offsets', {})[tid] = offsets
+        else:
+            pref.get('tournament_offsets', {}).pop(tid, None)
+    elif offsets:
+        pref['offsets'] = offsets
+    else:
+        pref.pop('offsets', None)
+        pref.pop('tournament_offsets', None)
+    with shared_file_lock(USER_PREFS_FILE):
+        load_user_prefs()[chat_id] = pref  # пока ждали календарь, файл могла перечитать другая реплика
+        save_user_prefs()
+    await update.message.reply_text("✅ Напоминания:\n" + describe_reminders(pref))
+
+# === Подписки на игроков (/follow) ===
+# Два индекса:
+#   player_index  — нормализованное имя -> [(турнир, роль)], строится из снимка календаря;
+#   follower_index — нормализованное имя -> chat_id подписчиков, хранится в FOLLOWS_FILE.
+# Для каждого нового результата берём подписчиков ровно этого игрока, так что работа
+# пропорциональна числу совпавших подписчиков, а не «все чаты × все игроки».
+# Финалиста календарь показывает только после финала (колонка Runner-up заполняется
+# по его итогам), поэтому «вышел в финал» приходит вместе с результатом финала.
+FOLLOW_CHECK_INTERVAL = 1800  # секунд между проверками календаря
+MAX_FOLLOWS_PER_CHAT = 20
+
+def normalize_name(name):
+    """'Ronnie O\'Sullivan' и 'ronnie osullivan' -> 'ronnie osullivan'; флаги и диакритика убираются."""
+    text = unicodedata.normalize('NFKD', name or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[’'`.]", '', text.lower())
+    text = re.sub(r'[^\w]+', ' ', text)
+    return ' '.join(text.split())
+
+def build_player_index(tournaments):
+    index = {}
+    for t in tournaments:
+        for role in ('winner', 'runner_up'):
+            name = t.get(f'{role}_name')
+            if name:
+                index.setdefault(normalize_name(name), []).append((t, role))
+    return index
+
+def result_key(season_start, t, role):
+    return f"{season_start}|{t['start'].isoformat()}|{t['tournament']}|{role}|{normalize_name(t[f'{role}_name'])}"
+
+_follows = None
+
+def load_follows():
+    """{'followers': {имя: set(chat_id)}, 'names': {имя: как показывать}, 'seen': set(ключей результатов),
+    'initialised': уже известные результаты запомнены без рассылки}"""
+    global _follows
+    if _follows is None or shared_file_changed(FOLLOWS_FILE):
+        remember_version(FOLLOWS_FILE)
+        data = {}
+        if os.path.exists(FOLLOWS_FILE):
+            with open(FOLLOWS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        _follows = {
+            'followers': {k: set(v) for k, v in data.get('followers', {}).items()},
+            'names': data.get('names', {}),
+            'seen': set(data.get('seen', [])),
+            'initialised': data.get('initialised', bool(data.get('seen'))),  # старые файлы — по непустому seen
+        }
+    return _follows
+
+def save_follows():
+    write_json_atomic(FOLLOWS_FILE, {
+        'followers': {k: sorted(v) for k, v in _follows['followers'].items() if v},
+        'names': _follows['names'],
+        'seen': sorted(_follows['seen']),
+        'initialised': _follows['initialised'],
+    }, ensure_ascii=False)
+
+def resolve_player(query, candidates):
+    """Ищет query среди candidates (имён для показа) по полному имени или части; -> (имя | None, варианты)."""
+    wanted = normalize_name(query)
+    by_norm = {normalize_name(c): c for c in candidates}
+    if wanted in by_norm:
+        return by_norm[wanted], []
+    matches = [c for norm, c in by_norm.items() if wanted in norm]
+    if len(matches) == 1:
+        return matches[0], []
+    return None, matches[:10]
+
+def known_players():
+    names = set()
+    try:
+        names.update(p['player'] for p in get_ranking_players() or [])
+    except Exception as e:
+        logging.warning(f"Не удалось получить рейтинг для поиска игрока: {e}")
+    for t in get_schedule_tournaments():
+        names.update(n for n in (t.get('winner_name'), t.get('runner_up_name')) if n)
+    return names
+
+def collect_follow_events(tournaments, previous_season, seen, today):
+    """Новые события для подписчиков: (ключ, нормализованное имя, текст). Список seen дополняется."""
+    season_start = current_season(today)
+    events = []
+    for norm, entries in build_player_index(tournaments).items():
+        for t, role in entries:
+            key = result_key(season_start, t, role)
+            if key in seen:
+                continue
+            seen.add(key)
+            name = t[f'{role}_name']
+            if role == 'winner':
+                text = f"🏆 Победа: {name} — чемпион {t['tournament']}! Финал: {t['score']}"
+            else:
+                text = f"🥈 {name} — финалист {t['tournament']} (победитель {t['winner_name']}, {t['score']})"
+            events.append((key, norm, text))
+
+    # Турниры, стартующие завтра: оповещаем подписчиков прошлогодних финалистов этого турнира
+    tomorrow = today + timedelta(days=1)
+    starting = {t['tournament'] for t in tournaments if t['start'] == tomorrow}
+    if starting:
+        for norm, entries in build_player_index(previous_season).items():
+            for t, role in entries:
+                if t['tournament'] not in starting:
+                    continue
+                key = f"start|{tomorrow.isoformat()}|{t['tournament']}|{norm}"
+                if key in seen:
+                    continue
+                seen.add(key)
+                what = "защищает титул" if role == 'winner' else "прошлогодний финалист"
+                events.append((key, norm, f"🎱 Завтра стартует {t['tournament']} — {t[f'{role}_name']} {what}"))
+    return events
+
+async def check_followed_players(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        today = datetime.now(LOCAL_TZ).date()
+        tournaments = await asyncio.to_thread(get_schedule_tournaments)
+        if not tournaments:
+            return
+        previous = await asyncio.to_thread(get_schedule_tournaments, current_season(today) - 1)
+
+        follows = load_follows()
+        first_run = not follows['initialised']
+        events = collect_follow_events(tournaments, previous, follows['seen'], today)
+        if not first_run:  # при самом первом запуске просто запоминаем уже известные результаты
+            for _, norm, text in events:
+                chat_ids = follows['followers'].get(norm)
+                if chat_ids:
+                    await send_broadcast(context.bot, chat_ids, text)
+        if events or first_run:
+            with shared_file_lock(FOLLOWS_FILE):
+                current = load_follows()  # за время рассылки файл могла поменять другая реплика
+                current['seen'] |= follows['seen']
+                current['initialised'] = True
+                save_follows()
+    except Exception as e:
+        logging.error(f"Ошибка в check_followed_players: {e}")
+
+@track_command("follow")
+@throttled("follow")
+async def follow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    query = " ".join(context.args)
+    if not query:
+        await update.message.reply_text("Укажи игрока, например: /follow Judd Trump")
+        return
+
+    candidates = await asyncio.to_thread(known_players)
+    name, options = resolve_player(query, candidates)
+    if not name:
+        if options:
+            await update.message.reply_text("Нашлось несколько игроков:\n" + "\n".join(options))
+        else:
+            await update.message.reply_text("Не нашёл такого игрока в рейтинге и календаре.")
+        return
+
+    norm = normalize_name(name)
+    with shared_file_lock(FOLLOWS_FILE):
+        follows = load_follows()
+        followed = [n for n, chats in follows['followers'].items() if chat_id in chats]
+        full = norm not in followed and len(followed) >= MAX_FOLLOWS_PER_CHAT
+        if not full:
+            follows['followers'].setdefault(norm, set()).add(chat_id)
+            follows['names'][norm] = name
+            save_follows()
+    if full:
+        await update.message.reply_text(f"⚠️ Можно следить максимум за {MAX_FOLLOWS_PER_CHAT} игроками.")
+        return
+    await update.message.reply_text(
+        f"👀 Слежу за {name}: сообщу о победах, финалах и о старте турниров, где игрок защищает прошлогодний результат."
+    )
+
+@track_command("unfollow")
+async def unfollow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    with shared_file_lock(FOLLOWS_FILE):
+        follows = load_follows()
+        norm = normalize_name(" ".join(context.args))
+        if chat_id not in follows['followers'].get(norm, set()):
+            followed = [follows['names'].get(n, n) for n, chats in follows['followers'].items() if chat_id in chats]
+            name, _ = resolve_player(norm, followed)
+            norm = normalize_name(name) if name else None
+        if norm:
+            follows['followers'][norm].discard(chat_id)
+            save_follows()
+    if not norm:
+        await update.message.reply_text("⚠️ Ты не следишь за таким игроком. Список: /following")
+        return
+    await update.message.reply_text(f"✅ Больше не слежу за {follows['names'].get(norm, norm)}.")
+
+@track_command("following")
+async def following_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    follows = load_follows()
+    followed = sorted(follows['names'].get(n, n) for n, chats in follows['followers'].items() if chat_id in chats)
+    if not followed:
+        await update.message.reply_text("Ты ни за кем не следишь. Добавить: /follow Judd Trump")
+        return
+    await update.message.reply_text("👀 Ты следишь за:\n" + "\n".join(followed))
+
+# === История рейтинга (колоночное хранилище) ===
+# Каждый изменившийся снимок рейтинга дописывается в RANKING_HISTORY_DIR колонками:
+#   player.bin (int32 id игрока), position.bin (int16), points.bin (int32) — по строке на игрока,
+#   snapshot_index.bin — (дата ordinal, первая строка, конец) на каждый снимок,
+#   players.json — id -> имя.
+# Файлы только дописываются и читаются через np.memmap, запросы — векторные операции numpy.
+# Запись индекса — последний шаг: строки колонок за концом последнего снимка в индексе
+# (дозапись ещё идёт или оборвалась) читатели не видят, а писатель их отрезает.
+# Пишет историю только лидер (см. «Реплики и лидер») и под shared_file_lock; остальные реплики
+# лишь читают её и перечитывают players.json, когда лидер добавил новые имена.
+SNAPSHOT_DTYPE = np.dtype([('date', '<i8'), ('start', '<i8'), ('end', '<i8')])
+LEGACY_SNAPSHOT_DTYPE = np.dtype([('date', '<i8'), ('start', '<i8')])  # snapshots.bin без концов снимков
+HISTORY_COLUMNS = {'player': np.dtype('<i4'), 'position': np.dtype('<i2'), 'points': np.dtype('<i4')}
+
+_history_lock = threading.Lock()
+_history_players = None  # список имён, индекс — id
+_history_ids = None      # нормализованное имя -> id
+
+def history_path(name):
+    return os.path.join(RANKING_HISTORY_DIR, name)
+
+def load_history_players():
+    global _history_players, _history_ids
+    if _history_players is None or shared_file_changed(history_path('players.json')):
+        remember_version(history_path('players.json'))
+        _history_players = []
+        if os.path.exists(history_path('players.json')):
+            with open(history_path('players.json'), 'r', encoding='utf-8') as f:
+                _history_players = json.load(f)
+        _history_ids = {normalize_name(name): i for i, name in enumerate(_history_players)}
+    return _history_players
+
+def history_player_id(name):
+    """id игрока в истории; новые имена получают следующий id."""
+    load_history_players()
+    norm = normalize_name(name)
+    if norm not in _history_ids:
+        _history_ids[norm] = len(_history_players)
+        _history_players.append(name)
+    return _history_ids[norm]
+
+def read_column(name, dtype):
+    path = history_path(name)
+    rows = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if not rows:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))  # недописанный хвост не читаем
+
+def legacy_snapshot_index(rows):
+    """Индекс из старого snapshots.bin: конец снимка — начало следующего, у последнего — rows."""
+    legacy = read_column('snapshots.bin', LEGACY_SNAPSHOT_DTYPE)
+    index = np.zeros(len(legacy), dtype=SNAPSHOT_DTYPE)
+    index['date'], index['start'] = legacy['date'], legacy['start']
+    index['end'] = np.append(legacy['start'][1:], rows)
+    return index
+
+def load_ranking_history():
+    """Колонки истории (memmap) до конца последнего записанного снимка + индекс снимков."""
+    snapshots = read_column('snapshot_index.bin', SNAPSHOT_DTYPE)
+    columns = {name: read_column(f"{name}.bin", dtype) for name, dtype in HISTORY_COLUMNS.items()}
+    if not len(snapshots) and os.path.exists(history_path('snapshots.bin')):
+        snapshots = legacy_snapshot_index(min(len(c) for c in columns.values()))
+    end = int(snapshots['end'][-1]) if len(snapshots) else 0
+    history = {name: column[:end] for name, column in columns.items()}
+    history['snapshots'] = snapshots
+    return history
+
+def snapshot_slice(history, index):
+    """Границы строк снимка index (отрицательные — с конца)."""
+    snapshot = history['snapshots'][index % len(history['snapshots'])]
+    return slice(int(snapshot['start']), int(snapshot['end']))
+
+def record_ranking_snapshot(players, today=None):
+    """Дописывает снимок, только если он отличается от последнего. Возвращает True, если записан."""
+    today = today or datetime.now(LOCAL_TZ).date()
+    os.makedirs(RANKING_HISTORY_DIR, exist_ok=True)
+    with _history_lock, shared_file_lock(history_path('players.json')):
+        ids = np.array([history_player_id(p['player']) for p in players], dtype=HISTORY_COLUMNS['player'])
+        positions = np.array([p['position_value'] for p in players], dtype=HISTORY_COLUMNS['position'])
+        points = np.array([p['points_value'] for p in players], dtype=HISTORY_COLUMNS['points'])
+
+        history = load_ranking_history()
+        if len(history['snapshots']):
+            last = snapshot_slice(history, -1)
+            if (np.array_equal(history['player'][last], ids)
+                    and np.array_equal(history['position'][last], positions)
+                    and np.array_equal(history['points'][last], points)):
+                return False
+
+        snapshots = np.array(history['snapshots'])
+        start = int(snapshots['end'][-1]) if len(snapshots) else 0
+        del history  # закрываем memmap перед дозаписью
+        if len(snapshots) and not os.path.exists(history_path('snapshot_index.bin')):
+            with open(history_path('snapshot_index.bin'), 'wb') as f:  # переход со snapshots.bin
+                f.write(snapshots.tobytes())
+        # имена — раньше колонок, чтобы читатель не увидел id без имени
+        write_json_atomic(history_path('players.json'), _history_players, ensure_ascii=False)
+        for name, column in (('player', ids), ('position', positions), ('points', points)):
+            with open(history_path(f"{name}.bin"), 'ab') as f:
+                f.truncate(start * column.itemsize)  # хвост оборванной дозаписи
+                f.write(column.tobytes())
+        with open(history_path('snapshot_index.bin'), 'ab') as f:
+            f.write(np.array([(today.toordinal(), start, start + len(ids))], dtype=SNAPSHOT_DTYPE).tobytes())
+        return True
+
+def snapshot_by_player(history, index, size):
+    """Позиции и очки снимка, разложенные по id игрока (0 — нет в рейтинге)."""
+    rows = snapshot_slice(history, index)
+    positions = np.zeros(size, dtype=np.int32)
+    points = np.zeros(size, dtype=np.int64)
+    positions[history['player'][rows]] = history['position'][rows]
+    points[history['player'][rows]] = history['points'][rows]
+    return positions, points
+
+def ranking_movers(limit=5):
+    """Самые большие подъёмы и падения между двумя последними снимками: ([(имя, было, стало)], [...])."""
+    history = load_ranking_history()
+    if len(history['snapshots']) < 2:
+        return None
+    names = load_history_players()
+    size = len(names)
+    before, _ = snapshot_by_player(history, -2, size)
+    after, _ = snapshot_by_player(history, -1, size)
+    both = np.flatnonzero((before > 0) & (after > 0))
+    delta = before[both] - after[both]  # > 0 — поднялся
+    order = np.argsort(-delta, kind='stable')
+    risers = [(names[i], int(before[i]), int(after[i])) for i in both[order[:limit]] if before[i] > after[i]]
+    fallers = [(names[i], int(before[i]), int(after[i])) for i in both[order[::-1][:limit]] if before[i] < after[i]]
+    return risers, fallers
+
+def ranking_gap(name, around=2):
+    """Разница в очках между игроком и соседями по последнему снимку: [(позиция, имя, очки, разница)]."""
+    history = load_ranking_history()
+    load_history_players()
+    pid = _history_ids.get(normalize_name(name))
+    if not len(history['snapshots']) or pid is None:
+        return None
+    rows = snapshot_slice(history, -1)
+    ids = np.asarray(history['player'][rows])
+    points = np.asarray(history['points'][rows], dtype=np.int64)
+    hit = np.flatnonzero(ids == pid)
+    if not len(hit):
+        return None
+    i = int(hit[0])
+    gaps = points - points[i]
+    lo, hi = max(0, i - around), min(len(ids), i + around + 1)
+    positions = np.asarray(history['position'][rows])
+    return [(int(positions[j]), _history_players[ids[j]], int(points[j]), int(gaps[j])) for j in range(lo, hi)]
+
+def ranking_trend(name):
+    """Позиции игрока во всех снимках: [(дата, позиция, очки)]."""
+    history = load_ranking_history()
+    load_history_players()
+    pid = _history_ids.get(normalize_name(name))
+    if not len(history['snapshots']) or pid is None:
+        return []
+    rows = np.flatnonzero(np.asarray(history['player']) == pid)
+    snapshot_index = np.searchsorted(history['snapshots']['start'], rows, side='right') - 1
+    dates = history['snapshots']['date'][snapshot_index]
+    return [
+        (datetime.fromordinal(int(d)).date(), int(pos), int(pts))
+        for d, pos, pts in zip(dates, history['position'][rows], history['points'][rows])
+    ]
+
+# === Уведомления об изменениях рейтинга ===
+# Свежий разбор сравнивается с последним снимком истории за один проход по игрокам.
+# Изменения копятся в очереди и раз в RANKING_CHECK_INTERVAL рассылаются: подписчикам
+# конкретного игрока (/follow) — про него, включившим /ranking_updates — сводка.
+RANKING_CHECK_INTERVAL = 3600
+RANKING_SUMMARY_LINES = 15
+
+_ranking_changes = deque()  # списки изменений, ждущие рассылки
+
+def last_ranking_snapshot():
+    """Последний снимок истории: нормализованное имя -> (имя, позиция, очки)."""
+    history = load_ranking_history()
+    if not len(history['snapshots']):
+        return {}
+    names = load_history_players()
+    rows = snapshot_slice(history, -1)
+    return {
+        normalize_name(names[pid]): (names[pid], int(pos), int(pts))
+        for pid, pos, pts in zip(history['player'][rows], history['position'][rows], history['points'][rows])
+    }
+
+def diff_rankings(previous, players):
+    """Изменения позиций и очков: [{'player', 'old_position', 'new_position', 'old_points', 'new_points'}].
+
+    Один проход по новому рейтингу; выбывшие из таблицы — отдельными записями с new_position=0.
+    """
+    changes = []
+    remaining = dict(previous)
+    for p in players:
+        key = normalize_name(p['player'])
+        old = remaining.pop(key, None)
+        old_position, old_points = (old[1], old[2]) if old else (0, 0)
+        if old_position != p['position_value'] or old_points != p['points_value']:
+            changes.append({
+                'player': p['player'],
+                'old_position': old_position,
+                'new_position': p['position_value'],
+                'old_points': old_points,
+                'new_points': p['points_value'],
+            })
+    for name, position, points in remaining.values():
+        changes.append({'player': name, 'old_position': position, 'new_position': 0,
+                        'old_points': points, 'new_points': 0})
+    return changes
+
+def describe_ranking_change(c):
+    if not c['old_position']:
+        return f"{c['player']}: новичок рейтинга, #{c['new_position']} ({c['new_points']:,} очков)"
+    if not c['new_position']:
+        return f"{c['player']}: выбыл(а) из рейтинга (был(а) #{c['old_position']})"
+    move = c['old_position'] - c['new_position']
+    arrow = f"↑{move}" if move > 0 else f"↓{-move}" if move < 0 else "="
+    return (f"{c['player']}: #{c['old_position']} → #{c['new_position']} ({arrow}), "
+            f"{c['old_points']:,} → {c['new_points']:,} очков")
+
+async def check_ranking_changes(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(get_ranking_players)
+        while _ranking_changes:
+            changes = _ranking_changes.popleft()
+            follows = load_follows()
+            for c in changes:
+                chat_ids = follows['followers'].get(normalize_name(c['player']))
+                if chat_ids:
+                    await send_broadcast(context.bot, chat_ids, "📊 Рейтинг обновился\n" + describe_ranking_change(c))
+
+            opted_in = {chat_id for chat_id, pref in load_user_prefs().items() if pref.get('ranking_updates')}
+            if opted_in:
+                moved = sorted(changes, key=lambda c: -abs(c['old_position'] - c['new_position']))
+                lines = [describe_ranking_change(c) for c in moved[:RANKING_SUMMARY_LINES]]
+                more = len(changes) - len(lines)
+                text = "📊 Мировой рейтинг обновился:\n" + "\n".join(lines) + (f"\n...и ещё {more}" if more > 0 else "")
+                await send_broadcast(context.bot, opted_in, text)
+    except Exception as e:
+        logging.error(f"Ошибка в check_ranking_changes: {e}")
+
+@track_command("ranking_updates")
+async def ranking_updates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    with shared_file_lock(USER_PREFS_FILE):
+        pref = load_user_prefs().setdefault(chat_id, {})
+        pref['ranking_updates'] = not pref.get('ranking_updates')
+        save_user_prefs()
+    if pref['ranking_updates']:
+        await update.message.reply_text("✅ Пришлю сводку, когда мировой рейтинг изменится.")
+    else:
+        await update.message.reply_text("✅ Сводки об изменениях рейтинга выключены.")
+
+@track_command("movers")
+@throttled("movers")
+async def movers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(get_ranking_players)  # свежий снимок попадёт в историю, если изменился
+    result = ranking_movers()
+    if not result:
+        await update.message.reply_text("Пока мало истории рейтинга: нужно хотя бы два разных снимка.")
+        return
+    risers, fallers = result
+    lines = ["📈 Поднялись:"] + ([f"{name}: {a} → {b} (+{a - b})" for name, a, b in risers] or ["—"])
+    lines += ["", "📉 Опустились:"] + ([f"{name}: {a} → {b} (−{b - a})" for name, a, b in fallers] or ["—"])
+    await update.message.reply_text("\n".join(lines))
+
+@track_command("trend")
+async def trend_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = " ".join(context.args)
+    name, options = resolve_player(query, load_history_players()) if query else (None, [])
+    if not name:
+        await update.message.reply_text(
+            "Уточни игрока:\n" + "\n".join(options) if options else "Укажи игрока, например: /trend Judd Trump"
+        )
+        return
+    trend = ranking_trend(name)[-15:]
+    lines = [f"📊 {name}:"] + [f"{d.strftime('%d.%m.%Y')}: #{pos}, {pts:,} очков" for d, pos, pts in trend]
+    gap = ranking_gap(name)
+    if gap:
+        lines += ["", "Соседи по рейтингу:"] + [f"#{pos} {n} — {pts:,} ({diff:+,})" for pos, n, pts, diff in gap]
+    await update.message.reply_text("\n".join(lines))
+
+# === Прогноз рейтинга (/whatif) ===
+# Очки рейтинга — призовые, поэтому "что если игрок X дойдёт до раунда R" — это его очки
+# плюс призовые за раунд R. Матрица (игроки × раунды) считается одним выражением NumPy,
+# новое место — число игроков с очками строго больше (двоичный поиск по отсортированным очкам).
+# Прочие игроки считаются не набравшими очков; сгорающие очки двухлетней давности не учитываются.
+
+# Ориентировочная раскладка призовых по раундам (от победы к первому раунду), ключ — tournament_id
+PRIZE_BREAKDOWNS = {
+    'world snooker championship': [('Победа', 500000), ('Финал', 200000), ('1/2', 100000), ('1/4', 50000),
+                                   ('1/8', 30000), ('1/16', 20000), ('Квалификация', 15000)],
+    'uk championship': [('Победа', 250000), ('Финал', 100000), ('1/2', 50000), ('1/4', 25000),
+                        ('1/8', 15000), ('1/16', 10000), ('1/32', 7500)],
+    'saudi arabia snooker masters': [('Победа', 500000), ('Финал', 200000), ('1/2', 100000), ('1/4', 50000),
+                                     ('1/8', 25000), ('1/16', 15000), ('1/32', 10000)],
+}
+DEFAULT_PRIZE_BREAKDOWN = [('Победа', 100000), ('Финал', 45000), ('1/2', 20000), ('1/4', 13500),
+                           ('1/8', 9000), ('1/16', 6000), ('1/32', 3500)]
+PRIZE_ALIASES = {  # как турнир называют чаще, чем в календаре
+    'world championship': 'world snooker championship',
+    'crucible': 'world snooker championship',
+    'uk': 'uk championship',
+    'saudi arabia masters': 'saudi arabia snooker masters',
+}
+# Пригласительные турниры: призовые есть, рейтинговых очков нет
+NON_RANKING_EVENTS = {
+    'masters', 'champion of champions', 'shanghai masters', 'championship league invitational',
+    'hong kong masters', 'macau masters', 'riyadh season snooker championship',
+    'world seniors championship', 'world mixed doubles', 'six red world championship',
+}
+QUALIFIER_RE = re.compile(r'\bqualif')  # отбор очков не даёт: их дают раунды основного турнира
+
+def prize_breakdown(tournament):
+    """Раскладка призовых по точному tournament_id; None — турнир не даёт рейтинговых очков."""
+    tid = tournament_id(tournament or '')
+    tid = PRIZE_ALIASES.get(tid, tid)
+    if tid in NON_RANKING_EVENTS or QUALIFIER_RE.search(tid):
+        return None
+    return PRIZE_BREAKDOWNS.get(tid, DEFAULT_PRIZE_BREAKDOWN)
+
+def project_positions(points, gains):
+    """Места всех игроков для каждого раунда: матрица (len(points), len(gains)).
+
+    Место = 1 + число игроков, у которых очков строго больше, чем у игрока после прибавки.
+    Собственные очки игрока не мешают: они не больше очков с прибавкой.
+    """
+    points = np.asarray(points, dtype=np.int64)
+    projected = points[:, None] + np.asarray(gains, dtype=np.int64)[None, :]
+    ordered = np.sort(points)
+    return len(points) - np.searchsorted(ordered, projected, side='right') + 1
+
+def next_tournament(today=None):
+    """Ближайший ещё не закончившийся рейтинговый турнир текущего сезона или None."""
+    today = today or datetime.now(LOCAL_TZ).date()
+    upcoming = [t for t in get_schedule_tournaments()
+                if (t.get('finish') or t['start']) >= today and prize_breakdown(t['tournament'])]
+    return upcoming[0]['tournament'] if upcoming else None
+
+def whatif_projection(players, name, tournament):
+    """[(раунд, прибавка, очки, новое место)] для игрока name по раскладке турнира."""
+    breakdown = prize_breakdown(tournament) or []
+    gains = [prize for _, prize in breakdown]
+    points = [p['points_value'] for p in players]
+    index = next(i for i, p in enumerate(players) if p['player'] == name)
+    positions = project_positions(points, gains)[index]
+    return [(label, gain, points[index] + gain, int(pos))
+            for (label, gain), pos in zip(breakdown, positions)]
+
+@track_command("whatif")
+@throttled("whatif")
+async def whatif_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query, _, tournament = " ".join(context.args).partition("|")
+    players = await asyncio.to_thread(get_ranking_players)
+    if not players:
+        await update.message.reply_text("Не удалось получить рейтинг 😕")
+        return
+    name, options = resolve_player(query.strip(), [p['player'] for p in players]) if query.strip() else (None, [])
+    if not name:
+        await update.message.reply_text(
+            "Уточни игрока:\n" + "\n".join(options) if options
+            else "Укажи игрока, например: /whatif Judd Trump или /whatif Judd Trump | UK Championship"
+        )
+        return
+    tournament = tournament.strip() or await asyncio.to_thread(next_tournament)
+    if tournament and prize_breakdown(tournament) is None:
+        await update.message.reply_text(f"«{tournament}» не даёт рейтинговых очков (пригласительный турнир или отбор).")
+        return
+    current = next(p for p in players if p['player'] == name)
+    lines = [f"🔮 {name}, сейчас #{current['position_value']} ({current['points_value']:,} очков)",
+             f"Турнир: {tournament or 'типовой рейтинговый'}", ""]
+    lines += [f"{label}: +{gain:,} → {total:,}, место #{pos}"
+              for label, gain, total, pos in whatif_projection(players, name, tournament)]
+    lines += ["", "Без учёта сгорающих очков и результатов соперников."]
+    await update.message.reply_text("\n".join(lines))
+
+# === Inline-поиск (@bot запрос) ===
+# Отсортированный массив ключей (нормализованное имя и каждый его хвост с начала слова:
+# "john higgins", "higgins") -> номер записи. Префикс ищется двоичным поиском, индекс
+# строится один раз на пару снимков рейтинга и календаря; сам inline-ответ в сеть не ходит.
+INLINE_RESULTS_LIMIT = 20
+
+_search_index = {'sources': None, 'keys': [], 'entries': []}
+
+def build_search_index(players, tournaments):
+    entries = []
+    for p in players or []:
+        entries.append({'kind': 'player', 'title': p['player'],
+                        'position': p['position_value'], 'points': p['points_value']})
+    for t in tournaments or []:
+        entries.append({'kind': 'tournament', 'title': t['tournament'], 'tournament': t})
+    keys = []
+    for i, entry in enumerate(entries):
+        words = normalize_name(entry['title']).split()
+        for start in range(len(words)):
+            keys.append((' '.join(words[start:]), i))
+    keys.sort()
+    return keys, entries
+
+def search_index():
+    """Индекс по текущим снимкам; перестраивается, только если снимок сменился."""
+    players = _ranking_parsed['players']
+    tournaments = _season_snapshots.get(current_season())
+    sources = _search_index['sources']
+    if sources is None or sources[0] is not players or sources[1] is not tournaments:
+        keys, entries = build_search_index(players, tournaments)
+        _search_index.update(sources=(players, tournaments), keys=keys, entries=entries)
+    return _search_index
+
+def search_prefix(query, limit=INLINE_RESULTS_LIMIT):
+    """Записи, у которых имя или слово имени начинается с query; игроки — по месту в рейтинге."""
+    wanted = normalize_name(query)
+    if not wanted:
+        return []
+    index = search_index()
+    keys, entries = index['keys'], index['entries']
+    found = []
+    seen = set()
+    for key, i in itertools.islice(keys, bisect.bisect_left(keys, (wanted,)), None):
+        if not key.startswith(wanted):
+            break
+        if i not in seen:
+            seen.add(i)
+            found.append(entries[i])
+    found.sort(key=lambda e: (e['kind'] != 'player', e.get('position') or 0))
+    return found[:limit]
+
+def describe_search_entry(entry, upcoming):
+    if entry['kind'] == 'player':
+        text = f"#{entry['position']} {entry['title']} — {entry['points']:,} очков"
+        if upcoming:
+            text += f"\nБлижайший турнир: {upcoming['tournament']} ({upcoming['start'].strftime('%d.%m')})"
+        return text
+    t = entry['tournament']
+    text = f"🏆 {t['tournament']}\n📅 {t['start_str']} – {t['finish_str']}"
+    if t.get('venue'):
+        text += f"\n📍 {t['venue']}"
+    if t.get('winner'):
+        text += f"\n🥇 {t['winner']} {t.get('score', '')} {t.get('runner_up', '')}".rstrip()
+    return text
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t0 = time.perf_counter()
+    try:
+        if _ranking_parsed['players'] is None:
+            await asyncio.to_thread(get_ranking_players)  # первый запрос после старта
+        today = datetime.now(LOCAL_TZ).date()
+        tournaments = _season_snapshots.get(current_season()) or []
+        upcoming = next((t for t in tournaments if t['start'] >= today), None)
+        results = [
+            InlineQueryResultArticle(
+                id=hashlib.sha1(f"{entry['kind']}|{entry['title']}".encode('utf-8')).hexdigest()[:32],
+                title=entry['title'],
+                description=describe_search_entry(entry, upcoming).split('\n', 1)[-1],
+                input_message_content=InputTextMessageContent(describe_search_entry(entry, upcoming)),
+            )
+            for entry in search_prefix(update.inline_query.query)
+        ]
+        await update.inline_query.answer(results, cache_time=60)
+    except Exception as e:
+        logging.error(f"Ошибка в inline_query: {e}")
+    finally:
+        observe('snooker_inline_duration_seconds', time.perf_counter() - t0)
+
+# === Нечёткий поиск игрока (/player) ===
+# Триграммный индекс по латинским именам из рейтинга, календаря и истории рейтинга.
+# Кириллица сначала транслитерируется. Кроме обычных триграмм индексируется «скелет»
+# имени без гласных: транслитерация чаще всего путает именно гласные (Салливан/Sullivan,
+# Трамп/Trump). Оценка ограничена: точный счёт считается только для FUZZY_MAX_CANDIDATES
+# имён с наибольшим числом общих триграмм, а слишком частые триграммы пропускаются.
+FUZZY_MAX_CANDIDATES = 30
+FUZZY_MAX_POSTING = 500
+FUZZY_MIN_SCORE = 0.35
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+_fuzzy_index = {'sources': None, 'names': [], 'grams': [], 'postings': {}}
+
+def transliterate(text):
+    # Джадд -> jadd, ближе к Judd; Чжао -> zhao, как в пиньине
+    text = normalize_name(text).replace('дж', 'j').replace('чж', 'zh')
+    return ''.join(CYRILLIC_TO_LATIN.get(ch, ch) for ch in text)
+
+def name_trigrams(text):
+    """Триграммы слов и их согласных скелетов; скелетные помечены префиксом '~'."""
+    grams = set()
+    for word in transliterate(text).split():
+        skeleton = re.sub(r'[aeiouy]', '', word)
+        for token, mark in ((word, ''), (skeleton, '~')):
+            padded = f"  {token} "
+            grams.update(mark + padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def fuzzy_sources():
+    players = _ranking_parsed['players']
+    tournaments = _season_snapshots.get(current_season())
+    history = load_history_players()
+    return players, tournaments, len(history)
+
+def fuzzy_index():
+    """Индекс перестраивается, только если сменился снимок рейтинга, календаря или истории."""
+    sources = fuzzy_sources()
+    cached = _fuzzy_index['sources']
+    if cached is None or cached[0] is not sources[0] or cached[1] is not sources[1] or cached[2] != sources[2]:
+        players, tournaments, _ = sources
+        names = {p['player'] for p in players or []}
+        for t in tournaments or []:
+            names.update(n for n in (t.get('winner_name'), t.get('runner_up_name')) if n)
+        names.update(load_history_players())
+        names = sorted(names)
+        grams = [name_trigrams(n) for n in names]
+        postings = {}
+        for i, name_grams in enumerate(grams):
+            for g in name_grams:
+                postings.setdefault(g, []).append(i)
+        _fuzzy_index.update(sources=sources, names=names, grams=grams, postings=postings)
+    return _fuzzy_index
+
+def fuzzy_find_player(query, limit=5):
+    """[(оценка, имя)] по убыванию оценки (коэффициент Дайса по триграммам)."""
+    wanted = name_trigrams(query)
+    if not wanted:
+        return []
+    index = fuzzy_index()
+    postings = index['postings']
+    lists = sorted((postings[g] for g in wanted if g in postings), key=len)
+    counts = {}
+    for i, posting in enumerate(lists):
+        if i >= 2 and len(posting) > FUZZY_MAX_POSTING:
+            break
+        for n in posting:
+            counts[n] = counts.get(n, 0) + 1
+    candidates = heapq.nlargest(FUZZY_MAX_CANDIDATES, counts, key=counts.get)
+    scored = []
+    for n in candidates:
+        grams = index['grams'][n]
+        score = 2 * len(wanted & grams) / (len(wanted) + len(grams))
+        if score >= FUZZY_MIN_SCORE:
+            scored.append((round(score, 3), index['names'][n]))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return scored[:limit]
+
+def describe_player(name):
+    lines = [f"🎱 {name}"]
+    player = next((p for p in _ranking_parsed['players'] or [] if p['player'] == name), None)
+    if player:
+        lines.append(f"Рейтинг: #{player['position_value']}, {player['points_value']:,} очков")
+    results = build_player_index(_season_snapshots.get(current_season()) or []).get(normalize_name(name), [])
+    for t, role in results:
+        lines.append(f"{'🥇 Победа' if role == 'winner' else '🥈 Финал'}: {t['tournament']} ({t['score']})")
+    return "\n".join(lines)
+
+@track_command("player")
+async def player_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = " ".join(context.args)
+    if not query:
+        await update.message.reply_text("Укажи игрока, например: /player Салливан")
+        return
+    if _ranking_parsed['players'] is None:
+        await asyncio.to_thread(get_ranking_players)
+    found = fuzzy_find_player(query)
+    if not found:
+        await update.message.reply_text("Никого похожего не нашёл 😕")
+        return
+    text = describe_player(found[0][1])
+    if len(found) > 1:
+        text += "\n\nПохожие: " + ", ".join(name for _, name in found[1:])
+    await update.message.reply_text(text)
+
+# === HTTP-сервер: /metrics и /healthz ===
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("PORT", "8080"))  # Render передаёт порт web-сервиса в PORT
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+               500: 'Internal Server Error'}
+HTTP_MAX_BODY = 256 * 1024  # апдейты Telegram — единицы килобайт; больше не читаем вовсе
+HTTP_MAX_HEADERS = 100
+HTTP_HEADER_TIMEOUT = 10  # секунд на все заголовки после строки запроса — медленный клиент не держит соединение
+
+async def metrics_route(method, headers, body):
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', render_metrics()
+
+async def health_route(method, headers, body):
+    return 200, 'text/plain; charset=utf-8', 'ok\n'
+
+# путь -> async (method, headers, body) -> (статус, content-type, тело)
+HTTP_ROUTES = {
+    '/metrics': metrics_route,
+    '/healthz': health_route,
+}
+
+# путь -> (method, headers) -> None или (статус, content-type, тело); проверка до чтения тела,
+# чтобы неавторизованный клиент не заставил сервер принять и буферизовать тело запроса
+HTTP_GUARDS = {}
+
+HTTP_KEEPALIVE_TIMEOUT = 75  # секунд простоя до закрытия keep-alive соединения
+
+class BadHttpRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+async def read_http_headers(reader):
+    """Читает заголовки до пустой строки; не больше HTTP_MAX_HEADERS."""
+    headers = {}
+    for _ in range(HTTP_MAX_HEADERS + 1):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon or not name.strip():
+            raise BadHttpRequest(400, 'bad header')
+        headers[name.strip().lower()] = value.strip()
+    raise BadHttpRequest(431, 'too many headers')
+
+async def handle_http_request(reader, writer):
+    """Обрабатывает один запрос; возвращает False, если соединение надо закрыть."""
+    request_line = await asyncio.wait_for(reader.readline(), HTTP_KEEPALIVE_TIMEOUT)
+    if not request_line:
+        return False
+    try:
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise BadHttpRequest(400, 'bad request line')
+        method, target, version = parts
+        headers = await asyncio.wait_for(read_http_headers(reader), HTTP_HEADER_TIMEOUT)
+        length = headers.get('content-length', '0') or '0'
+        if not (length.isascii() and length.isdigit()):  # int() принял бы и «-1», и «1_0»
+            raise BadHttpRequest(400, 'bad content-length')
+        length = int(length)
+    except BadHttpRequest as e:
+        await write_http_response(writer, e.status, 'text/plain; charset=utf-8', f"{e}\n", keep_alive=False)
+        return False
+    path = target.split('?', 1)[0]
+    guard = HTTP_GUARDS.get(path)
+    rejected = guard(method, headers) if guard else None
+    if rejected is None and length > HTTP_MAX_BODY:
+        rejected = 413, 'text/plain; charset=utf-8', 'payload too large\n'
+    if rejected is not None:  # тело не читаем, поэтому соединение дальше использовать нельзя
+        await write_http_response(writer, *rejected, keep_alive=False)
+        return False
+    body = await reader.readexactly(length) if length else b''
+
+    route = HTTP_ROUTES.get(path)
+    if route is None:
+        status, content_type, payload = 404, 'text/plain; charset=utf-8', 'not found\n'
+    else:
+        try:
+            status, content_type, payload = await route(method, headers, body)
+        except Exception as e:
+            logging.error(f"Ошибка HTTP-обработчика {target}: {e}")
+            status, content_type, payload = 500, 'text/plain; charset=utf-8', 'error\n'
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    await write_http_response(writer, status, content_type, payload, keep_alive)
+    return keep_alive
+
+async def write_http_response(writer, status, content_type, payload, keep_alive):
+    data = payload.encode('utf-8')
+    writer.write(
+        f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+    )
+    await writer.drain()
+
+async def handle_http_connection(reader, writer):
+    try:
+        while await handle_http_request(reader, writer):
+            pass
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(application):
+    server = await asyncio.start_server(handle_http_connection, HTTP_HOST, HTTP_PORT)
+    application.bot_data['http_server'] = server
+    logging.info(f"HTTP-сервер слушает {HTTP_HOST}:{HTTP_PORT}")
+
+async def stop_http_server(application):
+    server = application.bot_data.pop('http_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+
+# === Webhook-режим ===
+# BOT_MODE=webhook — Telegram сам присылает апдейты POST-запросами на общий HTTP-сервер
+# (тот же порт, что /metrics и /healthz). По умолчанию — run_polling.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")  # внешний адрес сервиса
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))  # 1..100, у Telegram по умолчанию 40
+
+def webhook_secret():
+    """Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; если не задан — выводится из токена."""
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256((TELEGRAM_TOKEN or '').encode('utf-8')).hexdigest()
+
+def webhook_guard(method, headers):
+    """Метод и секретный заголовок проверяются до чтения тела."""
+    if method != 'POST':
+        return 405, 'text/plain; charset=utf-8', 'method not allowed\n'
+    token = headers.get('x-telegram-bot-api-secret-token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), webhook_secret().encode('utf-8')):
+        inc_counter('snooker_webhook_updates_total', result='forbidden')
+        return 403, 'text/plain; charset=utf-8', 'forbidden\n'
+    return None
+
+async def webhook_route(application, method, headers, body):
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except ValueError:
+        inc_counter('snooker_webhook_updates_total', result='bad_request')
+        return 400, 'text/plain; charset=utf-8', 'bad request\n'
+    await application.update_queue.put(update)
+    inc_counter('snooker_webhook_updates_total', result='ok')
+    return 200, 'text/plain; charset=utf-8', 'ok\n'
+
+async def run_webhook(application, stop_event=None):
+    """Аналог run_polling для webhook-режима: работает до SIGINT/SIGTERM или stop_event."""
+    HTTP_GUARDS[WEBHOOK_PATH] = webhook_guard
+    HTTP_ROUTES[WEBHOOK_PATH] = functools.partial(webhook_route, application)
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=webhook_secret(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logging.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        else:
+            logging.warning("WEBHOOK_URL не задан — webhook не регистрируется, жду апдейты на уже настроенный адрес")
+        await application.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+# === Реплики и лидер ===
+# Бота можно запустить в нескольких экземплярах над общим каталогом данных. Команды обрабатывает
+# любая реплика, а планировщик, напоминания, live-опрос и, значит, все рассылки — только лидер.
+# Лидер держит аренду в общей SQLite-базе LEADER_DB и продлевает её каждые LEASE_HEARTBEAT секунд;
+# если продлений нет дольше LEASE_TTL, аренду забирает другая реплика и номер срока (term) растёт.
+# Ежедневные сообщения перед отправкой отмечаются в таблице deliveries той же транзакцией, что
+# проверяет аренду и term: сообщение за дату уходит чату один раз, даже если старый лидер
+# завис посреди рассылки, а новый догоняет её тики.
+LEADER_DB = os.getenv("LEADER_DB", "replicas.sqlite")
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = 30  # секунд без продления, после которых лидер считается упавшим
+LEASE_HEARTBEAT = 10
+DELIVERY_RETENTION_DAYS = 7
+REPLICA_SYNC_INTERVAL = 60
+SHARED_ALERT_FILES = (SUBSCRIBERS_FILE, USER_PREFS_FILE, TOURNAMENT_SUBS_FILE)
+
+_lease = {'term': None, 'until': 0.0}  # term — пока эта реплика лидер; until — до когда аренда точно наша
+_synced_versions = {}
+
+def leader_db():
+    conn = sqlite3.connect(LEADER_DB, timeout=10, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT, term INTEGER, expires REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS deliveries (key TEXT, chat_id TEXT, sent REAL, PRIMARY KEY (key, chat_id))")
+    return conn
+
+def lease_row(conn):
+    return conn.execute("SELECT holder, term, expires FROM lease WHERE name = 'leader'").fetchone()
+
+def renew_lease(now=None):
+    """Берёт свободную или продлевает свою аренду; -> term, если эта реплика лидер, иначе None."""
+    now = now or time.time()
+    with contextlib.closing(leader_db()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = lease_row(conn)
+        if row and row[0] != REPLICA_ID and row[2] > now:
+            conn.execute("ROLLBACK")
+            return None
+        term = row[1] if row and row[0] == REPLICA_ID else (row[1] + 1 if row else 1)
+        conn.execute("INSERT OR REPLACE INTO lease VALUES ('leader', ?, ?, ?)", (REPLICA_ID, term, now + LEASE_TTL))
+        conn.execute("COMMIT")
+        return term
+
+def release_lease():
+    """При штатной остановке отдаёт аренду сразу, не дожидаясь LEASE_TTL."""
+    with contextlib.closing(leader_db()) as conn:
+        conn.execute("UPDATE lease SET expires = 0 WHERE name = 'leader' AND holder = ?", (REPLICA_ID,))
+
+def is_leader():
+    return _lease['term'] is not None and time.time() < _lease['until']
+
+def claim_deliveries(key, chat_ids):
+    """Отмечает доставку key чатам chat_ids; -> чаты, которым её ещё никто не отправлял.
+
+    Пусто, если аренда уже не наша или сменился term, — бывший лидер ничего не разошлёт.
+    """
+    now = time.time()
+    with contextlib.closing(leader_db()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = lease_row(conn)
+        if not row or row[0] != REPLICA_ID or row[1] != _lease['term'] or row[2] <= now:
+            conn.execute("ROLLBACK")
+            return set()
+        claimed = {
+            chat_id for chat_id in chat_ids
+            if conn.execute("INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?)", (key, chat_id, now)).rowcount
+        }
+        conn.execute("COMMIT")
+        return claimed
+
+def forget_old_deliveries():
+    with contextlib.closing(leader_db()) as conn:
+        conn.execute("DELETE FROM deliveries WHERE sent < ?", (time.time() - DELIVERY_RETENTION_DAYS * 86400,))
+
+async def sync_replicas(context: ContextTypes.DEFAULT_TYPE):
+    """Задача лидера: если подписки или настройки поменяли другие реплики, перекладывает колесо."""
+    try:
+        versions = {path: file_version(path) for path in SHARED_ALERT_FILES}
+        if versions != _synced_versions:
+            if _synced_versions:
+                await rebuild_wheel(context)
+            _synced_versions.update(versions)
+        await asyncio.to_thread(forget_old_deliveries)
+    except Exception as e:
+        logging.error(f"Ошибка в sync_replicas: {e}")
+
+def start_leader_tasks(application):
+    _ranking_parsed['players'] = None  # новый лидер сверит текущий рейтинг с историей заново
+    # изменения календаря считаются от первого свежего снимка нового лидера: старый снимок
+    # реплики мог отстать от уже разосланного прежним лидером
+    _schedule_changes.clear()
+    _season_snapshots.pop(current_season(), None)
+    for name, loop in LEADER_TASKS.items():
+        application.bot_data[name] = asyncio.create_task(loop(application))
+
+def stop_leader_tasks(application):
+    for name in LEADER_TASKS:
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+
+async def leader_loop(application):
+    """Продлевает аренду и запускает или останавливает задачи лидера при смене роли."""
+    while True:
+        started = time.time()
+        try:
+            term = await asyncio.to_thread(renew_lease, started)
+            if term is not None:
+                _lease['until'] = started + LEASE_TTL - LEASE_HEARTBEAT  # запас на задержку продления
+        except Exception as e:
+            logging.error(f"Ошибка в leader_loop: {e}")
+            term = _lease['term'] if is_leader() else None  # без базы лидер дорабатывает оплаченный срок
+        if term != _lease['term']:
+            stop_leader_tasks(application)
+            _lease['term'] = term
+            if term is not None:
+                logging.info(f"Реплика {REPLICA_ID} стала лидером (срок {term})")
+                start_leader_tasks(application)
+            else:
+                logging.warning(f"Реплика {REPLICA_ID} больше не лидер")
+        await asyncio.sleep(LEASE_HEARTBEAT)
+
+# === Планировщик задач ===
+# Один цикл вместо job_queue: для каждой задачи в SCHEDULER_FILE хранятся время последнего
+# запуска и следующий срок. После рестарта пропущенные сроки, которые не старше grace
+# задачи, догоняются по порядку (тики колеса — каждый, остальные задачи — один раз);
+# более старые пропускаются. Между запусками цикл спит ровно до ближайшего срока.
+SCHEDULER_FILE = "scheduler_state.json"
+
+# имя -> функция и расписание: every — период в секундах (align — по границам периода),
+# daily — время суток в поясе tz, first — задержка первого запуска, grace — окно догона,
+# on_start — выполнить при каждом старте до остальных (колесо живёт только в памяти)
+JOBS = {
+    'rebuild_wheel': {'func': rebuild_wheel, 'daily': dt_time(0, 0), 'tz': pytz.utc, 'on_start': True,
+                      'grace': 86400},
+    'daily_notification': {'func': daily_notification, 'every': WHEEL_SLOT_MINUTES * 60, 'align': True,
+                           'grace': 3 * 3600},
+    'evict_buckets': {'func': evict_buckets, 'every': BUCKET_EVICT_INTERVAL, 'grace': 0},
+    'prefetch_next_season': {'func': prefetch_next_season, 'daily': dt_time(4, 0), 'tz': LOCAL_TZ, 'grace': 86400},
+    'check_followed_players': {'func': check_followed_players, 'every': FOLLOW_CHECK_INTERVAL, 'first': 60,
+                               'grace': FOLLOW_CHECK_INTERVAL},
+    'check_ranking_changes': {'func': check_ranking_changes, 'every': RANKING_CHECK_INTERVAL, 'first': 120,
+                              'grace': RANKING_CHECK_INTERVAL},
+    'announce_schedule_changes': {'func': announce_schedule_changes, 'every': SCHEDULE_CHECK_INTERVAL, 'first': 90,
+                                  'grace': SCHEDULE_CHECK_INTERVAL},
+    'sync_replicas': {'func': sync_replicas, 'every': REPLICA_SYNC_INTERVAL, 'grace': 0},
+}
+
+_job_due = {}  # имя -> срок (unix time), за который сейчас выполняется задача
+_scheduler_state = None
+
+def load_scheduler_state():
+    global _scheduler_state
+    if _scheduler_state is None:
+        _scheduler_state = {}
+        if os.path.exists(SCHEDULER_FILE):
+            with open(SCHEDULER_FILE, 'r', encoding='utf-8') as f:
+                _scheduler_state = json.load(f)
+    return _scheduler_state
+
+def save_scheduler_state():
+    write_json_atomic(SCHEDULER_FILE, _scheduler_state, indent=1)
+
+def next_due_after(job, after):
+    """Ближайший срок задачи строго позже after (unix time)."""
+    if 'daily' in job:
+        tz = job['tz']
+        day = datetime.fromtimestamp(after, tz).date()
+        while True:
+            candidate = tz.localize(datetime.combine(day, job['daily'])).timestamp()
+            if candidate > after:
+                return candidate
+            day += timedelta(days=1)
+    if job.get('align'):
+        return (after // job['every'] + 1) * job['every']
+    return after + job['every']
+
+def initial_due(job, now):
+    if 'first' in job:
+        return now + job['first']
+    return next_due_after(job, now)
+
+def schedule_after_run(name, due, now):
+    """Следующий срок после запуска за due; сроки старше grace пропускаются."""
+    job = JOBS[name]
+    following = next_due_after(job, due)
+    if following <= now - job['grace']:
+        skipped = following
+        following = next_due_after(job, now - job['grace'])
+        logging.warning(f"Планировщик: {name} пропускает сроки с {datetime.fromtimestamp(skipped)} — старше окна догона")
+    return following
+
+def init_scheduler(now=None):
+    """Сроки задач из файла; новым задачам — первый срок, слишком старым — ближайший в окне догона."""
+    global _scheduler_state
+    now = now or time.time()
+    _scheduler_state = None  # новый лидер продолжает с того, что записал предыдущий
+    state = load_scheduler_state()
+    for name, job in JOBS.items():
+        entry = state.setdefault(name, {})
+        due = entry.get('next_due')
+        if due is None:
+            entry['next_due'] = initial_due(job, now)
+        elif due < now - job['grace']:
+            entry['next_due'] = next_due_after(job, now - job['grace']) if job['grace'] else initial_due(job, now)
+            if entry['next_due'] < now and not job.get('align'):
+                entry['next_due'] = now  # обычная задача догоняется одним запуском
+    save_scheduler_state()
+    return state
+
+async def run_job(application, name, due):
+    job = JOBS[name]
+    _job_due[name] = due
+    t0 = time.perf_counter()
+    try:
+        await job['func'](CallbackContext(application))
+    except Exception as e:
+        logging.error(f"Ошибка в задаче {name}: {e}")
+    finally:
+        _job_due.pop(name, None)
+        observe('snooker_job_duration_seconds', time.perf_counter() - t0, job=name)
+    now = time.time()
+    entry = load_scheduler_state()[name]
+    entry['last_run'] = now
+    entry['next_due'] = schedule_after_run(name, due, now)
+    save_scheduler_state()
+
+async def scheduler_loop(application):
+    """Запускает задачи в срок; одна и та же задача не выполняется в двух экземплярах сразу."""
+    state = init_scheduler()
+    for name, job in JOBS.items():
+        if job.get('on_start'):
+            await run_job(application, name, time.time())
+    running = {}
+    wakeup = asyncio.Event()
+    while True:
+        now = time.time()
+        for name in JOBS:
+            if name not in running and state[name]['next_due'] <= now:
+                task = asyncio.create_task(run_job(application, name, state[name]['next_due']))
+                task.add_done_callback(lambda _, name=name: (running.pop(name, None), wakeup.set()))
+                running[name] = task
+        pending = [state[name]['next_due'] for name in JOBS if name not in running]
+        delay = max(0, min(pending) - time.time()) if pending else None
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+# Задачи, которые работают только на лидере (см. leader_loop)
+LEADER_TASKS = {
+    'scheduler_task': scheduler_loop,
+    'reminder_task': reminder_loop,
+    'live_task': live_loop,
+}
+
 # === Запуск бота ===
-if __name__ == '__main__':
-    import nest_asyncio
-    nest_asyncio.apply()
+async def on_startup(application):
+    await start_http_server(application)
+    application.bot_data['leader_task'] = asyncio.create_task(leader_loop(application))
+
+async def on_shutdown(application):
+    task = application.bot_data.pop('leader_task', None)
+    if task:
+        task.cancel()
+    stop_leader_tasks(application)
+    if _lease['term'] is not None:
+        try:
+            release_lease()
+        except Exception as e:
+            logging.warning(f"Не удалось отдать аренду лидера: {e}")
+    await stop_http_server(application)
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+def build_application():
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .request(MetricsRequest(connection_pool_size=256))
+        .get_updates_request(MetricsRequest())
+        .job_queue(None)  # периодические задачи ведёт scheduler_loop
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("unsubscribe", unsubscribe))
     app.add_handler(CommandHandler("current_season_schedule", schedule_command))
     app.add_handler(CommandHandler("players_ranking", ranking_command))
     app.add_handler(CommandHandler("upcoming_tournament", next_tournament_command))
+    app.add_handler(CommandHandler("season", season_command))
+    app.add_handler(CommandHandler("follow", follow_command))
+    app.add_handler(CommandHandler("unfollow", unfollow_command))
+    app.add_handler(CommandHandler("following", following_command))
+    app.add_handler(CommandHandler("tournaments", tournaments_command))
+    app.add_handler(CommandHandler("timezone", timezone_command))
+    app.add_handler(CommandHandler("hour", hour_command))
+    app.add_handler(CommandHandler("reminders", reminders_command))
+    app.add_handler(CommandHandler("movers", movers_command))
+    app.add_handler(CommandHandler("trend", trend_command))
+    app.add_handler(CommandHandler("ranking_updates", ranking_updates_command))
+    app.add_handler(CommandHandler("whatif", whatif_command))
+    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(CommandHandler("player", player_command))
+    app.add_handler(CommandHandler("tournament", tournament_command))
+    app.add_handler(CommandHandler("live", live_command))
+    app.add_handler(CallbackQueryHandler(tournament_toggle_callback, pattern=r'^tsub:'))
     app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), message_handler))
+    # Периодические задачи (колесо рассылки, проверки, префетч) запускает scheduler_loop, см. JOBS
+    return app
 
-    # Запуск ежедневного задания в 21:00 по Москве
-    app.job_queue.run_daily(daily_notification, time=dt_time(0, 42, tzinfo=LOCAL_TZ))
+if __name__ == '__main__':
+    import nest_asyncio
+    nest_asyncio.apply()
 
-    app.run_polling()
+    app = build_application()
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
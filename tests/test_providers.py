@@ -0,0 +1,228 @@
+"""
+Выбор провайдера данных (resolve_records, provider_order) и записи API результатов.
+
+Провайдеры здесь — локальные заглушки, API результатов — HTTP-сервер на 127.0.0.1,
+так что тесты не ходят в сеть.
+
+    python -m pytest -q tests
+"""
+import json
+import os
+import sys
+import threading
+from collections import deque
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snooker_alert_bot as bot  # noqa: E402
+
+
+def player(position, name, points):
+    return {'position': str(position), 'player': name, 'points': f"{points:,}",
+            'position_value': position, 'points_value': points}
+
+
+GOOD = [player(1, 'Judd Trump', 1000), player(2, 'Kyren Wilson', 900)]
+OTHER = [player(1, 'Mark Selby', 800)]
+
+
+def broken():
+    raise bot.requests.ConnectionError('провайдер недоступен')
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Подменяет реестр провайдеров; возвращает функцию, регистрирующую заглушку по имени."""
+    registry = {}
+    calls = []
+    monkeypatch.setattr(bot, 'PROVIDERS', registry)
+    monkeypatch.setattr(bot, 'DATA_PROVIDERS', [])
+    monkeypatch.setattr(bot, 'PROVIDER_FANOUT', 1)
+    monkeypatch.setattr(bot, '_provider_stats', {})
+
+    def register(name, ranking):
+        def call():
+            calls.append(name)
+            return ranking()
+        registry[name] = {'ranking': call}
+        bot.DATA_PROVIDERS.append(name)
+
+    register.calls = calls
+    return register
+
+
+# === resolve_records ===
+def test_first_valid_answer_wins(providers):
+    providers('first', lambda: GOOD)
+    providers('second', lambda: OTHER)
+    assert bot.resolve_records('ranking') == GOOD
+    assert providers.calls == ['first']
+
+
+def test_failed_provider_falls_through(providers):
+    providers('down', broken)
+    providers('backup', lambda: GOOD)
+    assert bot.resolve_records('ranking') == GOOD
+    assert providers.calls == ['down', 'backup']
+
+
+def test_invalid_records_fall_through(providers):
+    providers('empty', lambda: [])
+    providers('partial', lambda: [{'player': 'Judd Trump'}])  # нет позиции и очков
+    providers('backup', lambda: GOOD)
+    assert bot.resolve_records('ranking') == GOOD
+    assert providers.calls == ['empty', 'partial', 'backup']
+
+
+def test_all_failed_raises(providers):
+    providers('down', broken)
+    with pytest.raises(bot.requests.ConnectionError):
+        bot.resolve_records('ranking')
+
+
+def test_answered_without_data_returns_empty(providers):
+    providers('down', broken)
+    providers('empty', lambda: [])
+    assert bot.resolve_records('ranking') == []
+
+
+def test_fanout_takes_first_valid_of_batch(providers, monkeypatch):
+    monkeypatch.setattr(bot, 'PROVIDER_FANOUT', 2)
+    providers('down', broken)
+    providers('backup', lambda: GOOD)
+    assert bot.resolve_records('ranking') == GOOD
+    assert sorted(providers.calls) == ['backup', 'down']
+
+
+# === provider_order ===
+def record_stats(name, ok, errors, latencies):
+    bot._provider_stats[(name, 'ranking')] = {'ok': ok, 'errors': errors, 'latencies': deque(latencies, maxlen=50)}
+
+
+def test_order_keeps_configuration_without_stats(providers):
+    providers('first', lambda: GOOD)
+    providers('second', lambda: GOOD)
+    assert bot.provider_order('ranking') == ['first', 'second']
+
+
+def test_order_prefers_fewer_errors(providers):
+    providers('flaky', lambda: GOOD)
+    providers('steady', lambda: GOOD)
+    record_stats('flaky', ok=5, errors=5, latencies=[0.01] * 5)
+    record_stats('steady', ok=10, errors=0, latencies=[0.5] * 10)
+    assert bot.provider_order('ranking') == ['steady', 'flaky']
+
+
+def test_order_prefers_lower_latency(providers):
+    providers('slow', lambda: GOOD)
+    providers('fast', lambda: GOOD)
+    record_stats('slow', ok=10, errors=0, latencies=[0.8] * 10)
+    record_stats('fast', ok=10, errors=0, latencies=[0.05] * 10)
+    assert bot.provider_order('ranking') == ['fast', 'slow']
+
+
+def test_order_puts_unmeasured_after_measured(providers):
+    providers('primary', lambda: GOOD)
+    providers('fallback', lambda: GOOD)
+    record_stats('primary', ok=3, errors=0, latencies=[0.3] * 3)
+    providers('fallback_2', lambda: GOOD)
+    bot.DATA_PROVIDERS[:] = ['fallback', 'primary', 'fallback_2']
+    assert bot.provider_order('ranking') == ['primary', 'fallback', 'fallback_2']
+
+
+def test_failures_reorder_resolution(providers):
+    providers('down', broken)
+    providers('backup', lambda: GOOD)
+    bot.resolve_records('ranking')
+    providers.calls.clear()
+    assert bot.provider_order('ranking') == ['backup', 'down']
+    assert bot.resolve_records('ranking') == GOOD
+    assert providers.calls == ['backup']
+
+
+def test_results_api_needs_url(providers, monkeypatch):
+    providers('results_api', lambda: GOOD)
+    monkeypatch.setattr(bot, 'RESULTS_API_URL', None)
+    assert bot.provider_order('ranking') == []
+
+
+# === API результатов ===
+RESULTS = {
+    '/seasons/2025/tournaments': [
+        {'name': 'UK Championship', 'start': '2025-11-22', 'finish': '2025-11-30', 'venue': 'York Barbican',
+         'winner': 'Mark Selby', 'winner_country': 'ENG', 'runner_up': 'Judd Trump', 'runner_up_country': 'ENG',
+         'score': '10–8', 'url': 'https://en.wikipedia.org/wiki/2025_UK_Championship'},
+        {'name': 'Wuhan Open', 'start': '2025-10-05', 'finish': None},
+    ],
+    '/rankings': [
+        {'position': 1, 'player': 'Judd Trump', 'points': 1234567, 'country': 'ENG'},
+        {'position': 2, 'player': 'Zhao Xintong', 'points': 987654, 'country': 'CHN'},
+    ],
+}
+
+
+@pytest.fixture
+def results_api(monkeypatch):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in RESULTS:
+                self.send_error(404)
+                return
+            body = json.dumps(RESULTS[self.path]).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    bot.set_http_mode('live')
+    monkeypatch.setattr(bot, 'RESULTS_API_URL', f"http://127.0.0.1:{server.server_address[1]}/")
+    yield
+    server.shutdown()
+
+
+def test_results_api_schedule_records(results_api):
+    tournaments = bot.results_api_schedule(2025)
+    assert [t['tournament'] for t in tournaments] == ['Wuhan Open', 'UK Championship']  # по дате старта
+    assert bot.valid_records('schedule', tournaments)
+
+    uk = tournaments[1]
+    flag = bot.FLAG_EMOJI['ENG']
+    assert uk['start'] == date(2025, 11, 22) and uk['finish'] == date(2025, 11, 30)
+    assert (uk['start_str'], uk['finish_str']) == ('22 Nov', '30 Nov')
+    assert uk['winner'] == f"{flag} Mark Selby" and uk['winner_name'] == 'Mark Selby'
+    assert uk['runner_up'] == f"{flag} Judd Trump" and uk['runner_up_flag'] == flag
+    assert (uk['venue'], uk['score']) == ('York Barbican', '10–8')
+    assert uk['article_url'] == 'https://en.wikipedia.org/wiki/2025_UK_Championship'
+
+    wuhan = tournaments[0]
+    assert wuhan['finish'] is None and wuhan['finish_str'] == ''
+    assert wuhan['winner'] == '' and wuhan['winner_flag'] == '' and wuhan['venue'] == ''
+
+
+def test_results_api_ranking_records(results_api):
+    players = bot.results_api_ranking()
+    assert bot.valid_records('ranking', players)
+    assert players[0] == {
+        'position': '1', 'player': 'Judd Trump', 'points': '1,234,567',
+        'position_value': 1, 'points_value': 1234567, 'flag': bot.FLAG_EMOJI['ENG'],
+    }
+    assert players[1]['flag'] == bot.FLAG_EMOJI['CHN']
+
+
+def test_results_api_fingerprint_follows_content():
+    item = dict(RESULTS['/seasons/2025/tournaments'][0])
+    first = bot.tournament_record(item)['fingerprint']
+    assert bot.tournament_record(dict(item))['fingerprint'] == first
+    item['score'] = '10–9'
+    assert bot.tournament_record(item)['fingerprint'] != first